@@ -0,0 +1,748 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2013-2019, Schneider Electric Buildings AB
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Schneider Electric Buildings AB nor the
+#       names of contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from __future__ import print_function  # Python 2 compatibility
+
+import os
+import sys
+import timeit
+import multiprocessing
+import argparse  # Requires Python 2.7 or later, but that's OK for a benchmark driver
+from asn1ate import parser
+
+
+def read_sources(filenames):
+    sources = []
+    for filename in filenames:
+        with open(filename) as f:
+            sources.append((filename, f.read()))
+    return sources
+
+
+def best_of(func, repeat, number):
+    """ Return the best per-call time of func in seconds.
+    """
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+
+def bench_grammar(args):
+    """ Compare parse_asn1 with the shared grammar to parse_asn1 with a
+    grammar rebuilt for every call, as it was before the grammar was cached.
+    """
+    # Drop the shared grammar before every call, so parse_asn1 builds a new
+    # one and both sides strip comments and parse the same way.
+    def parse_rebuilt(source):
+        parser._asn1_grammars.clear()
+        return parser.parse_asn1(source)
+
+    build_time = best_of(parser._build_asn1_grammar, args.repeat, args.number)
+    print('Grammar construction: %.2f ms' % (build_time * 1000))
+    print()
+
+    print('%-40s %12s %12s %8s' % ('File', 'Rebuilt (ms)', 'Cached (ms)', 'Saved'))
+    total_rebuilt = total_cached = 0.0
+    for filename, source in read_sources(args.files):
+        rebuilt = best_of(lambda: parse_rebuilt(source), args.repeat, args.number)
+        cached = best_of(lambda: parser.parse_asn1(source), args.repeat, args.number)
+        total_rebuilt += rebuilt
+        total_cached += cached
+        print('%-40s %12.2f %12.2f %7.0f%%' % (filename, rebuilt * 1000, cached * 1000,
+                                              100.0 * (rebuilt - cached) / rebuilt))
+
+    print('%-40s %12.2f %12.2f %7.0f%%' % ('Total', total_rebuilt * 1000, total_cached * 1000,
+                                          100.0 * (total_rebuilt - total_cached) / total_rebuilt))
+    return 0
+
+
+def bench_memoize(args):
+    """ Compare plain parsing to packrat parsing with different cache sizes.
+    """
+    cache_sizes = args.cache_sizes or [128, 1024, 8192, 0]
+
+    for filename, source in read_sources(args.files):
+        print(filename)
+        plain = best_of(lambda: parser.parse_asn1(source), args.repeat, args.number)
+        print('  %-12s %10.2f ms' % ('plain', plain * 1000))
+        for cache_size in cache_sizes:
+            memoized = best_of(lambda: parser.parse_asn1(source, memoize=True,
+                                                         cache_size=cache_size or None),
+                               args.repeat, args.number)
+            hits, misses = parser.packrat_cache_stats()
+            print('  %-12s %10.2f ms  %8d hits %8d misses (%.0f%% hit rate)' %
+                  ('cache=%s' % (cache_size or 'inf'), memoized * 1000, hits, misses,
+                   100.0 * hits / max(hits + misses, 1)))
+    return 0
+
+
+def bench_parallel(args):
+    """ Parse a bundle of modules with different numbers of worker processes.
+    The bundle is the given files concatenated, copies times over.
+    """
+    bundle = ''.join(source + '\n' for _, source in read_sources(args.files)) * args.copies
+    module_count = len(parser.parse_asn1(bundle, backend=args.backend))
+    print('Bundle: %d modules, %d KiB' % (module_count, len(bundle) // 1024))
+
+    worker_counts = args.worker_counts or [1, 2, 4, multiprocessing.cpu_count()]
+    serial = None
+    for workers in worker_counts:
+        elapsed = best_of(lambda: parser.parse_asn1(bundle, backend=args.backend,
+                                                    workers=workers),
+                          args.repeat, args.number)
+        if serial is None:
+            serial = elapsed
+        print('  %-12s %10.2f ms  %5.2fx' % ('workers=%d' % workers, elapsed * 1000,
+                                             serial / elapsed))
+    return 0
+
+
+def bench_build(args):
+    """ Parse and build the semantic model of a bundle of modules with
+    different numbers of worker processes. The bundle is the given files
+    concatenated, copies times over.
+    """
+    from asn1ate import sema
+
+    bundle = ''.join(source + '\n' for _, source in read_sources(args.files)) * args.copies
+    print('Bundle: %d modules, %d KiB' % (len(parser.split_modules(bundle)[1]), len(bundle) // 1024))
+
+    # Do the work parallel builds do up front: all assignments and the
+    # dependency graph of every module.
+    def build(workers):
+        modules = sema.parse_semantic_model(bundle, workers=workers)
+        for module in modules:
+            module.dependency_graph()
+        return modules
+
+    worker_counts = args.worker_counts or [1, 2, 4, multiprocessing.cpu_count()]
+    serial = None
+    for workers in worker_counts:
+        elapsed = best_of(lambda: build(workers), args.repeat, args.number)
+        if serial is None:
+            serial = elapsed
+        print('  %-12s %10.2f ms  %5.2fx' % ('workers=%d' % workers, elapsed * 1000,
+                                             serial / elapsed))
+    return 0
+
+
+def bench_cache(args):
+    """ Compare parsing to loading the trees from a warm parse cache.
+    """
+    import shutil
+    import tempfile
+    from asn1ate.parsecache import ParseCache
+
+    cache_dir = tempfile.mkdtemp(prefix='asn1ate-bench-')
+    try:
+        cache = ParseCache(cache_dir)
+        print('%-40s %12s %12s %10s' % ('File', 'Parse (ms)', 'Cached (ms)', 'Entry KiB'))
+        for filename, source in read_sources(args.files):
+            parsed = best_of(lambda: parser.parse_asn1(source, backend=args.backend),
+                             args.repeat, args.number)
+            parser.parse_asn1(source, backend=args.backend, cache=cache)
+            cached = best_of(lambda: parser.parse_asn1(source, cache=cache), args.repeat, args.number)
+            entry_size = os.path.getsize(cache._entry_path(cache.key(source)))
+            print('%-40s %12.2f %12.2f %10.1f' % (filename, parsed * 1000, cached * 1000,
+                                                 entry_size / 1024.0))
+    finally:
+        shutil.rmtree(cache_dir)
+    return 0
+
+
+def bench_incremental(args):
+    """ Compare parsing a bundle of modules to re-parsing it in a ParseSession
+    after editing one module in the middle. The bundle is the given files
+    concatenated, copies times over.
+    """
+    from asn1ate import lexer
+
+    bundle = ''.join(source + '\n' for _, source in read_sources(args.files)) * args.copies
+    chunks = lexer.split_modules(bundle)
+    print('Bundle: %d modules, %d KiB' % (len(chunks), len(bundle) // 1024))
+
+    # Alternate between two versions of the middle module, so every
+    # re-parse sees a change.
+    start, end = chunks[len(chunks) // 2]
+    edit_at = bundle.rindex('END', start, end)
+    versions = [bundle, bundle[:edit_at] + '-- edited\n' + bundle[edit_at:]]
+
+    full = best_of(lambda: parser.parse_asn1(versions[1], backend=args.backend),
+                   args.repeat, args.number)
+    print('  %-12s %10.2f ms' % ('full', full * 1000))
+
+    session = parser.ParseSession(backend=args.backend)
+    session.parse(versions[0])
+    edits = [0]
+
+    def reparse():
+        edits[0] += 1
+        session.parse(versions[edits[0] % 2])
+
+    incremental = best_of(reparse, args.repeat, args.number)
+    print('  %-12s %10.2f ms  %5.1fx  (%d re-parsed, %d reused)' %
+          ('incremental', incremental * 1000, full / incremental, session.reparsed, session.reused))
+    return 0
+
+
+def bench_lazy(args):
+    """ Compare a full parse and semantic model to a lazy parse that only
+    builds some assignments and what they depend on. By default, that's the
+    first assignment of each module.
+    """
+    from asn1ate import sema
+
+    def build_eager(source):
+        return [module.assignments for module in sema.build_semantic_model(parser.parse_asn1(source))]
+
+    def build_lazy(source):
+        modules = sema.build_semantic_model(parser.parse_asn1(source, lazy=True))
+        required = []
+        for module in modules:
+            names = [name for name in args.names if name in module.assignment_names()] or \
+                    module.assignment_names()[:1]
+            required.append(module.required_assignments(names))
+        return modules, required
+
+    print('%-40s %12s %12s %14s' % ('File', 'Full (ms)', 'Lazy (ms)', 'Assignments'))
+    for filename, source in read_sources(args.files):
+        full = best_of(lambda: build_eager(source), args.repeat, args.number)
+        lazy = best_of(lambda: build_lazy(source), args.repeat, args.number)
+        modules, required = build_lazy(source)
+        total = sum(len(module.assignment_names()) for module in modules)
+        print('%-40s %12.2f %12.2f %6d of %5d' % (filename, full * 1000, lazy * 1000,
+                                                  sum(len(r) for r in required), total))
+    return 0
+
+
+class _DictToken(object):
+    """ AnnotatedToken as it was before it got __slots__, for comparison. """
+
+    def __init__(self, token_type, elements, start=None, end=None):
+        self.ty = token_type
+        self.elements = elements
+        self.start = start
+        self.end = end
+
+
+def copy_tree(node, token_class):
+    if type(node) is parser.AnnotatedToken:
+        return token_class(node.ty, copy_tree(node.elements, token_class), node.start, node.end)
+    elif type(node) is list:
+        return [copy_tree(element, token_class) for element in node]
+    return node
+
+
+def count_tokens(node):
+    if type(node) is parser.AnnotatedToken:
+        return 1 + count_tokens(node.elements)
+    elif type(node) is list:
+        return sum(count_tokens(element) for element in node)
+    return 0
+
+
+def traced_size(func):
+    """ Return the result of func and the number of bytes it allocated and
+    kept alive.
+    """
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, after - before
+
+
+def traced_peak(func):
+    """ Return the result of func and the peak number of bytes it had
+    allocated at any one time.
+    """
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, peak - before
+
+
+def bench_fused(args):
+    """ Compare parsing to a syntax tree and then building the semantic model
+    to building the semantic model straight from the parse.
+    """
+    from asn1ate import sema
+
+    # Modules build their assignments on first access, build them all.
+    def two_stage(source):
+        modules = sema.build_semantic_model(parser.parse_asn1(source, backend=args.backend))
+        return [module.assignments for module in modules]
+
+    def fused(source):
+        modules = sema.parse_semantic_model(source, backend=args.backend)
+        return [module.assignments for module in modules]
+
+    print('%-40s %12s %12s %16s %16s' % ('File', 'Two-stage', 'Fused', 'Two-stage peak', 'Fused peak'))
+    for filename, source in read_sources(args.files):
+        two_stage_time = best_of(lambda: two_stage(source), args.repeat, args.number)
+        fused_time = best_of(lambda: fused(source), args.repeat, args.number)
+        _, two_stage_peak = traced_peak(lambda: two_stage(source))
+        _, fused_peak = traced_peak(lambda: fused(source))
+        print('%-40s %9.2f ms %9.2f ms %12.1f KiB %12.1f KiB' %
+              (filename, two_stage_time * 1000, fused_time * 1000,
+               two_stage_peak / 1024.0, fused_peak / 1024.0))
+    return 0
+
+
+def recursive_descendants(node):
+    """ The list-building descendants traversal that iter_descendants replaced.
+    """
+    descendants = []
+    for child in node.children():
+        descendants.append(child)
+        descendants.extend(recursive_descendants(child))
+    return descendants
+
+
+def bench_descendants(args):
+    """ Compare the recursive, list-building descendants traversal to
+    iter_descendants, visiting every node of every module once.
+    """
+    import collections
+    from asn1ate import sema
+
+    def walk_recursive(modules):
+        for module in modules:
+            for _ in recursive_descendants(module):
+                pass
+
+    def walk_iterative(modules):
+        for module in modules:
+            collections.deque(module.iter_descendants(), maxlen=0)
+
+    print('%-40s %8s %12s %12s %16s %16s' % ('File', 'Nodes', 'Recursive', 'Iterative',
+                                             'Recursive peak', 'Iterative peak'))
+    for filename, source in read_sources(args.files):
+        modules = sema.build_semantic_model(parser.parse_asn1(source))
+        node_count = 0
+        for module in modules:
+            assert recursive_descendants(module) == module.descendants()
+            node_count += len(module.descendants())
+
+        recursive_time = best_of(lambda: walk_recursive(modules), args.repeat, args.number)
+        iterative_time = best_of(lambda: walk_iterative(modules), args.repeat, args.number)
+        _, recursive_peak = traced_peak(lambda: walk_recursive(modules))
+        _, iterative_peak = traced_peak(lambda: walk_iterative(modules))
+        print('%-40s %8d %9.2f ms %9.2f ms %12.1f KiB %12.1f KiB' %
+              (filename, node_count, recursive_time * 1000, iterative_time * 1000,
+               recursive_peak / 1024.0, iterative_peak / 1024.0))
+    return 0
+
+
+def bench_memory(args):
+    """ Measure parse tree memory, and compare to the same tree built from
+    tokens with a per-instance __dict__.
+    """
+    print('%-40s %8s %12s %12s %8s' % ('File', 'Tokens', 'Dict (KiB)', 'Slots (KiB)', 'Saved'))
+    for filename, source in read_sources(args.files):
+        parse_tree = parser.parse_asn1(source, backend=args.backend)
+        _, dict_size = traced_size(lambda: copy_tree(parse_tree, _DictToken))
+        _, slots_size = traced_size(lambda: copy_tree(parse_tree, parser.AnnotatedToken))
+        print('%-40s %8d %12.1f %12.1f %7.0f%%' % (filename, count_tokens(parse_tree),
+                                                  dict_size / 1024.0, slots_size / 1024.0,
+                                                  100.0 * (dict_size - slots_size) / dict_size))
+    return 0
+
+
+def bench_resolve(args):
+    """ Compare resolving every type reference in a specification against
+    a plain list of modules, which is wrapped in a new ModuleSet on every
+    call, to resolving them against a shared ModuleSet.
+    """
+    from asn1ate import sema
+
+    def resolve_all(references, referenced_modules):
+        for module, type_decl in references:
+            module.resolve_type_decl(type_decl, referenced_modules)
+
+    print('%-40s %10s %12s %12s' % ('File', 'References', 'List', 'ModuleSet'))
+    for filename, source in read_sources(args.files):
+        modules = sema.build_semantic_model(parser.parse_asn1(source))
+        references = [(module, node) for module in modules for node in module.iter_descendants()
+                      if isinstance(node, (sema.DefinedType, sema.SelectionType))]
+        list_time = best_of(lambda: resolve_all(references, modules), args.repeat, args.number)
+        module_set = sema.ModuleSet(modules)
+        set_time = best_of(lambda: resolve_all(references, module_set), args.repeat, args.number)
+        print('%-40s %10d %9.2f ms %9.2f ms' % (filename, len(references),
+                                                list_time * 1000, set_time * 1000))
+    return 0
+
+
+def bench_graph(args):
+    """ Compare dependency_sort with dependencies from references(), with
+    a freshly built dependency graph, and with the graph cached on the
+    module.
+    """
+    from asn1ate import sema
+
+    def sort_references(modules):
+        for module in modules:
+            sema.dependency_sort(module.assignments)
+
+    def sort_new_graph(modules):
+        for module in modules:
+            sema.dependency_sort(module.assignments, sema.DependencyGraph(module))
+
+    def sort_cached_graph(modules):
+        for module in modules:
+            sema.dependency_sort(module.assignments, module.dependency_graph())
+
+    print('%-40s %14s %14s %14s' % ('File', 'references()', 'New graph', 'Cached graph'))
+    for filename, source in read_sources(args.files):
+        modules = sema.build_semantic_model(parser.parse_asn1(source))
+        times = [best_of(lambda: sort(modules), args.repeat, args.number)
+                 for sort in (sort_references, sort_new_graph, sort_cached_graph)]
+        print('%-40s %11.2f ms %11.2f ms %11.2f ms' % ((filename,) + tuple(t * 1000 for t in times)))
+    return 0
+
+
+class _SyntheticAssignment(object):
+    __slots__ = ('name', 'dependencies')
+
+    def __init__(self, name, dependencies):
+        self.name = name
+        self.dependencies = dependencies
+
+    def reference_name(self):
+        return self.name
+
+    def references(self):
+        return self.dependencies
+
+
+def synthetic_assignments(count, seed=0):
+    """ Return count acyclic assignments, each referencing up to three
+    later ones and a built-in type.
+    """
+    import random
+
+    rng = random.Random(seed)
+    names = ['T%d' % i for i in range(count)]
+    assignments = []
+    for i, name in enumerate(names):
+        later = names[i + 1:i + 1 + 50]
+        dependencies = set(rng.sample(later, min(len(later), rng.randint(0, 3))))
+        dependencies.add('INTEGER')
+        assignments.append(_SyntheticAssignment(name, dependencies))
+    rng.shuffle(assignments)
+    return assignments
+
+
+def quadratic_topological_sort(assignments):
+    """ topological_sort as it was before it kept predecessor counts.
+    """
+    graph = dict((a.reference_name(), a.references()) for a in assignments)
+
+    def has_predecessor(node):
+        for predecessors in graph.values():
+            if node in predecessors:
+                return True
+
+        return False
+
+    topological_order = []
+    roots = [name for name in graph.keys()
+             if not has_predecessor(name)]
+
+    while roots:
+        root = roots.pop()
+        successors = graph.pop(root, set())
+        roots.extend(successor for successor in successors
+                     if not has_predecessor(successor))
+        topological_order.insert(0, root)
+
+    if graph:
+        raise Exception('Can\'t sort cyclic references: %s' % graph)
+
+    return sorted(assignments,
+                  key=lambda a: topological_order.index(a.reference_name()))
+
+
+def bench_toposort(args):
+    """ Scaling of topological_sort on synthetic modules, compared to the
+    quadratic version it replaced.
+    """
+    from asn1ate import sema
+
+    print('%-12s %14s %14s' % ('Assignments', 'Quadratic', 'Linear'))
+    for count in args.counts or [1000, 10000, 100000]:
+        assignments = synthetic_assignments(count)
+        linear_time = best_of(lambda: sema.topological_sort(assignments), args.repeat, args.number)
+        if count <= args.quadratic_limit:
+            assert quadratic_topological_sort(assignments) == sema.topological_sort(assignments)
+            quadratic_time = best_of(lambda: quadratic_topological_sort(assignments), 1, 1)
+            quadratic = '%11.2f ms' % (quadratic_time * 1000)
+        else:
+            quadratic = '%14s' % 'skipped'
+        print('%-12d %s %11.2f ms' % (count, quadratic, linear_time * 1000))
+    return 0
+
+
+def recursive_dependency_sort(assignments):
+    """ dependency_sort as it was before its Tarjan was made iterative.
+    """
+    assignments_by_name = {a.reference_name(): a for a in assignments}
+    graph = {}
+    for assignment in assignments:
+        references = sorted(assignment.references())
+        graph[assignment] = [assignments_by_name[r] for r in references
+                             if r in assignments_by_name]
+
+    index_counter = [0]
+    stack = []
+    lowlinks = {}
+    index = {}
+    result = []
+
+    def strongconnect(node):
+        index[node] = index_counter[0]
+        lowlinks[node] = index_counter[0]
+        index_counter[0] += 1
+        stack.append(node)
+
+        for successor in graph.get(node, []):
+            if successor not in lowlinks:
+                strongconnect(successor)
+                lowlinks[node] = min(lowlinks[node], lowlinks[successor])
+            elif successor in stack:
+                lowlinks[node] = min(lowlinks[node], index[successor])
+
+        if lowlinks[node] == index[node]:
+            connected_component = []
+            while True:
+                successor = stack.pop()
+                connected_component.append(successor)
+                if successor == node:
+                    break
+            result.append(tuple(connected_component))
+
+    for node in sorted(graph.keys(), key=lambda a: a.reference_name()):
+        if node not in lowlinks:
+            strongconnect(node)
+
+    return result
+
+
+def chained_assignments(count, cyclic):
+    """ Return count assignments each referencing the next, with the last
+    referencing the first if cyclic.
+    """
+    names = ['T%06d' % i for i in range(count)]
+    assignments = [_SyntheticAssignment(name, set(names[i + 1:i + 2]))
+                   for i, name in enumerate(names)]
+    if cyclic:
+        assignments[-1].dependencies.add(names[0])
+    return assignments
+
+
+def bench_scc(args):
+    """ Scaling of dependency_sort on synthetic modules, compared to the
+    recursive version it replaced.
+    """
+    from asn1ate import sema
+
+    print('%-12s %-8s %14s %14s' % ('Assignments', 'Shape', 'Recursive', 'Iterative'))
+    for count in args.counts or [1000, 10000, 100000]:
+        for shape, assignments in (('random', synthetic_assignments(count)),
+                                   ('chain', chained_assignments(count, False)),
+                                   ('cycle', chained_assignments(count, True))):
+            iterative_time = best_of(lambda: sema.dependency_sort(assignments), args.repeat, args.number)
+            try:
+                assert recursive_dependency_sort(assignments) == sema.dependency_sort(assignments)
+                recursive_time = best_of(lambda: recursive_dependency_sort(assignments), 1, 1)
+                recursive = '%11.2f ms' % (recursive_time * 1000)
+            except RuntimeError:  # RecursionError
+                recursive = '%14s' % 'too deep'
+            print('%-12d %-8s %s %11.2f ms' % (count, shape, recursive, iterative_time * 1000))
+    return 0
+
+
+def bench_model(args):
+    """ Measure the memory held by the semantic model, per sema node.
+    """
+    from asn1ate import sema
+
+    def build(parse_tree):
+        modules = sema.build_semantic_model(parse_tree)
+        for module in modules:
+            module.assignments
+        return modules
+
+    print('%-40s %8s %12s %12s' % ('File', 'Nodes', 'Size (KiB)', 'Per node (B)'))
+    for filename, source in read_sources(args.files):
+        parse_tree = parser.parse_asn1(source, backend=args.backend)
+        modules, size = traced_size(lambda: build(parse_tree))
+        node_count = sum(1 + len(module.descendants()) for module in modules)
+        print('%-40s %8d %12.1f %12.1f' % (filename, node_count, size / 1024.0,
+                                           size / float(node_count)))
+    return 0
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description='Benchmark driver for asn1ate.')
+    ap.add_argument('--repeat', type=int, default=3,
+                    help='Number of timing runs, best is reported (default: 3)')
+    ap.add_argument('--number', type=int, default=1,
+                    help='Number of calls per timing run (default: 1)')
+    benchmarks = ap.add_subparsers(dest='benchmark')
+    benchmarks.required = True
+
+    grammar = benchmarks.add_parser('grammar',
+                                    help='Per-call saving of the shared grammar.')
+    grammar.add_argument('files', nargs='+', help='ASN.1 files to parse.')
+    grammar.set_defaults(func=bench_grammar)
+
+    memoize = benchmarks.add_parser('memoize',
+                                    help='Packrat parsing with different cache sizes.')
+    memoize.add_argument('--cache-size', dest='cache_sizes', type=int, action='append',
+                         help='Cache size to measure, 0 for unbounded (repeatable)')
+    memoize.add_argument('files', nargs='+', help='ASN.1 files to parse.')
+    memoize.set_defaults(func=bench_memoize)
+
+    parallel = benchmarks.add_parser('parallel',
+                                     help='Scaling of parsing modules in a process pool.')
+    parallel.add_argument('--workers', dest='worker_counts', type=int, action='append',
+                          help='Number of worker processes to measure (repeatable)')
+    parallel.add_argument('--copies', type=int, default=1,
+                          help='Number of times to repeat the files in the bundle (default: 1)')
+    parallel.add_argument('--backend', choices=parser.BACKENDS, default='pyparsing',
+                          help='Parser backend to use (default: pyparsing)')
+    parallel.add_argument('files', nargs='+', help='ASN.1 files to bundle.')
+    parallel.set_defaults(func=bench_parallel)
+
+    build = benchmarks.add_parser('build',
+                                  help='Scaling of parsing and building modules in a process pool.')
+    build.add_argument('--workers', dest='worker_counts', type=int, action='append',
+                       help='Number of worker processes to measure (repeatable)')
+    build.add_argument('--copies', type=int, default=1,
+                       help='Number of times to repeat the files in the bundle (default: 1)')
+    build.add_argument('files', nargs='+', help='ASN.1 files to bundle.')
+    build.set_defaults(func=bench_build)
+
+    cache = benchmarks.add_parser('cache',
+                                  help='Parsing vs. loading trees from the parse cache.')
+    cache.add_argument('--backend', choices=parser.BACKENDS, default='pyparsing',
+                       help='Parser backend to compare to (default: pyparsing)')
+    cache.add_argument('files', nargs='+', help='ASN.1 files to parse.')
+    cache.set_defaults(func=bench_cache)
+
+    incremental = benchmarks.add_parser('incremental',
+                                        help='Re-parsing a bundle after editing one module.')
+    incremental.add_argument('--copies', type=int, default=1,
+                             help='Number of times to repeat the files in the bundle (default: 1)')
+    incremental.add_argument('--backend', choices=parser.BACKENDS, default='pyparsing',
+                             help='Parser backend to use (default: pyparsing)')
+    incremental.add_argument('files', nargs='+', help='ASN.1 files to bundle.')
+    incremental.set_defaults(func=bench_incremental)
+
+    lazy = benchmarks.add_parser('lazy',
+                                 help='Full vs. lazy parsing when only some assignments are used.')
+    lazy.add_argument('--name', dest='names', action='append', default=[],
+                      help='Assignment to build, along with its dependencies (repeatable)')
+    lazy.add_argument('files', nargs='+', help='ASN.1 files to parse.')
+    lazy.set_defaults(func=bench_lazy)
+
+    fused = benchmarks.add_parser('fused',
+                                  help='Two-stage vs. fused parsing into the semantic model.')
+    fused.add_argument('--backend', choices=parser.BACKENDS, default='pyparsing',
+                       help='Parser backend to use (default: pyparsing)')
+    fused.add_argument('files', nargs='+', help='ASN.1 files to parse.')
+    fused.set_defaults(func=bench_fused)
+
+    descendants = benchmarks.add_parser('descendants',
+                                        help='Recursive vs. iterative descendants traversal.')
+    descendants.add_argument('files', nargs='+', help='ASN.1 files to parse.')
+    descendants.set_defaults(func=bench_descendants)
+
+    memory = benchmarks.add_parser('memory',
+                                   help='Parse tree memory with compact tokens.')
+    memory.add_argument('--backend', choices=parser.BACKENDS, default='pyparsing',
+                        help='Parser backend to use (default: pyparsing)')
+    memory.add_argument('files', nargs='+', help='ASN.1 files to parse.')
+    memory.set_defaults(func=bench_memory)
+
+    resolve = benchmarks.add_parser('resolve',
+                                    help='Type resolution with and without a shared ModuleSet.')
+    resolve.add_argument('files', nargs='+', help='ASN.1 files to parse.')
+    resolve.set_defaults(func=bench_resolve)
+
+    graph = benchmarks.add_parser('graph',
+                                  help='Dependency sorting with and without the dependency graph.')
+    graph.add_argument('files', nargs='+', help='ASN.1 files to parse.')
+    graph.set_defaults(func=bench_graph)
+
+    toposort = benchmarks.add_parser('toposort',
+                                     help='Scaling of topological_sort on synthetic modules.')
+    toposort.add_argument('--count', dest='counts', type=int, action='append',
+                          help='Number of assignments to sort (repeatable, default: 1k, 10k, 100k)')
+    toposort.add_argument('--quadratic-limit', type=int, default=10000,
+                          help='Largest count to time the quadratic version with (default: 10000)')
+    toposort.set_defaults(func=bench_toposort)
+
+    scc = benchmarks.add_parser('scc',
+                                help='Scaling of dependency_sort on synthetic modules.')
+    scc.add_argument('--count', dest='counts', type=int, action='append',
+                     help='Number of assignments to sort (repeatable, default: 1k, 10k, 100k)')
+    scc.set_defaults(func=bench_scc)
+
+    model = benchmarks.add_parser('model',
+                                  help='Semantic model memory per node.')
+    model.add_argument('--backend', choices=parser.BACKENDS, default='pyparsing',
+                       help='Parser backend to use (default: pyparsing)')
+    model.add_argument('files', nargs='+', help='ASN.1 files to parse.')
+    model.set_defaults(func=bench_model)
+
+    return ap.parse_args()
+
+
+# Simplistic command-line driver
+def main():
+    args = parse_args()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,426 @@
+# Copyright (c) 2013-2019, Schneider Electric Buildings AB
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Schneider Electric Buildings AB nor the
+#       names of contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+""" A single-pass, regex-based lexer for ASN.1.
+
+``strip_comments`` blanks out comments in a single pass before parsing, so
+neither parser backend has to look for comments between tokens. ``tokenize``
+then turns the stripped source into a flat list of tokens with one compiled
+regular expression. The patterns for the individual terminals are also used by
+the pyparsing grammar in ``asn1ate.parser``, so both parser backends agree on
+what a terminal is.
+"""
+
+import re
+
+__all__ = ['strip_comments', 'split_modules', 'split_assignments', 'expand_tabs', 'blank', 'tokenize', 'Token',
+           'MULTIWORD_KEYWORDS', 'RESERVED_WORDS']
+
+
+# Terminal patterns
+WHITESPACE = r'[ \t\r\n]'
+COMMENT = r'--[\s\S]*?(?:--|$)|/\*(?:[^*]|\*(?!/))*\*/'
+VALUEREFERENCE = r'[a-z][-0-9a-zA-Z]*'
+TYPEREFERENCE = r'[A-Z][-0-9a-zA-Z]*'
+WORD = r'[A-Za-z][-0-9a-zA-Z]*'
+NUMBER = r'[0-9]+'
+SIGNED_NUMBER = r'-?[0-9]+'
+# A decimal point directly followed by another belongs to a range ('..').
+REAL_NUMBER = r'-?[0-9]+(?:\.(?!\.)[0-9]*)?(?:[eE]-?[0-9]+)?'
+# In value range constraints, decimal points must be followed by number, or
+# the grammar becomes ambiguous: ([1.].100) vs ([1]..[100])
+CONSTRAINT_REAL_NUMBER = r'-?[0-9]+(?:\.[0-9]+)?(?:[eE]-?[0-9]+)?'
+BSTRING = r"'(?:%s*[01])+%s*'B" % (WHITESPACE, WHITESPACE)
+HSTRING = r"'(?:%s*[0-9A-F])+%s*'H" % (WHITESPACE, WHITESPACE)
+# Like pyparsing's dblQuotedString, the body is matched greedily and must then
+# be followed by a closing quote.
+CSTRING_BODY = r'(?:[^"\n\r\\]|(?:"")|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*'
+PUNCTUATION = r'::=|\.\.\.|\.\.|[.{}()\[\],;|<]'
+
+# Reserved words consisting of more than one word. Like pyparsing's Keyword,
+# we require the words to be separated by exactly one space.
+MULTIWORD_KEYWORDS = (
+    'BIT STRING', 'CHARACTER STRING', 'COMPONENTS OF', 'DEFINED BY',
+    'EXPLICIT TAGS', 'EXTENSIBILITY IMPLIED', 'IMPLICIT TAGS',
+    'AUTOMATIC TAGS', 'OBJECT IDENTIFIER', 'OCTET STRING',
+)
+
+# Every word of the reserved words in the grammar. Like pyparsing's Keyword,
+# these end at a hyphen, so 'INTEGER--' is INTEGER followed by a comment,
+# while 'Foo--' is part of a word.
+RESERVED_WORDS = frozenset('''
+    ANY APPLICATION AUTOMATIC BEGIN BIT BMPString BOOLEAN BY CHARACTER CHOICE
+    COMPONENTS DEFAULT DEFINED DEFINITIONS END ENUMERATED EXPLICIT EXPORTS
+    EXTENSIBILITY FALSE FROM GeneralString GeneralizedTime GraphicString
+    IA5String IDENTIFIER IMPLICIT IMPLIED IMPORTS INTEGER ISO646String MAX MIN
+    NULL NumericString OBJECT OCTET OF OPTIONAL ObjectDescriptor
+    PrintableString PRIVATE REAL SEQUENCE SET SIZE STRING T61String TAGS
+    TRUE TeletexString UNIVERSAL UTCTime UTF8String UniversalString
+    VideotexString VisibleString
+'''.split())
+
+
+def keywords_pattern(keywords):
+    """ Build a pattern matching any of the given reserved words, with the
+    same word boundary rules as pyparsing's Keyword.
+    """
+    alternatives = '|'.join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+    return r'(?<![0-9A-Za-z_$])(?:%s)(?![0-9A-Za-z_$])' % alternatives
+
+
+class Token(object):
+    """ A lexical token; kind is one of 'word', 'keyword' (multi-word reserved
+    words), 'number', 'bstring', 'hstring', 'cstring', 'punct', 'invalid' or
+    'eof', value is the token text (or the digits for bstring/hstring) and
+    start/end are offsets into the source.
+    """
+    __slots__ = ('kind', 'value', 'start', 'end')
+
+    def __init__(self, kind, value, start, end):
+        self.kind = kind
+        self.value = value
+        self.start = start
+        self.end = end
+
+    def __str__(self):
+        return '%s(%r)' % (self.kind, self.value)
+
+    __repr__ = __str__
+
+
+_TOKEN_RE = re.compile(r"""
+    (?P<skip>%(whitespace)s+)
+  | (?P<keyword>%(keywords)s)
+  | (?P<word>%(word)s)
+  | (?P<number>%(number)s)
+  | (?P<bstring>%(bstring)s)
+  | (?P<hstring>%(hstring)s)
+  | (?P<cstring>")
+  | (?P<punct>%(punct)s)
+  | (?P<invalid>[\s\S])
+""" % {'whitespace': WHITESPACE,
+       'keywords': keywords_pattern(MULTIWORD_KEYWORDS), 'word': WORD,
+       'number': REAL_NUMBER, 'bstring': BSTRING, 'hstring': HSTRING,
+       'punct': PUNCTUATION},
+    re.VERBOSE | re.MULTILINE)
+
+_CSTRING_BODY_RE = re.compile(CSTRING_BODY)
+_WHITESPACE_RE = re.compile(WHITESPACE + '+')
+_COMMENT_OR_CSTRING_RE = re.compile(r'(?P<comment>%s)|"%s"' % (COMMENT, CSTRING_BODY), re.MULTILINE)
+_WORD_RE = re.compile(WORD)
+_NUMBER_RE = re.compile(REAL_NUMBER)
+_WORD_CHARS = frozenset('-0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+_BLANKED_RE = re.compile(r'[^\t\r\n]')
+# Words may contain hyphens, so unlike keywords_pattern, END must not be
+# adjacent to a hyphen either, unless it starts a comment.
+_MODULE_END_OR_CSTRING_RE = re.compile(r'(?P<end>(?<![-0-9A-Za-z_$])END(?![0-9A-Za-z_$]|-(?!-)))|"%s"'
+                                       % CSTRING_BODY)
+
+
+def strip_comments(source):
+    """ Blank out every comment in source, so that offsets, lines and columns
+    in the stripped text are the same as in source. Returns a
+    (stripped_source, comments) tuple, where comments is a list of (start, end)
+    offsets of the removed comments in source.
+
+    Comment markers inside character strings or words (identifiers may contain
+    hyphens, and the lexer reads 'a--b' as a single word) are left alone,
+    except right after a reserved word, see RESERVED_WORDS.
+    """
+    chunks = []
+    comments = []
+    last = 0
+    pos = 0
+    search = _COMMENT_OR_CSTRING_RE.search
+    while True:
+        m = search(source, pos)
+        if m is None:
+            break
+
+        if m.lastgroup != 'comment':
+            pos = m.end()
+            continue
+
+        start = m.start()
+        word_end = _enclosing_word_end(source, start)
+        if word_end is not None:
+            pos = word_end
+            continue
+
+        end = m.end()
+        chunks.append(source[last:start])
+        chunks.append(blank(source[start:end]))
+        comments.append((start, end))
+        last = pos = end
+
+    if not comments:
+        return source, comments
+
+    chunks.append(source[last:])
+    return ''.join(chunks), comments
+
+
+def split_modules(source):
+    """ Split source into chunks holding one module definition each, by
+    cutting after every END keyword outside of comments and strings. Returns
+    a list of (start, end) offsets of the chunks, text after the last END is
+    a final chunk unless it's whitespace.
+
+    This is a cheap scan that does not validate anything, parse each chunk to
+    find out whether it is a module definition.
+    """
+    stripped, _ = strip_comments(source)
+    chunks = []
+    last = 0
+    pos = 0
+    search = _MODULE_END_OR_CSTRING_RE.search
+    while True:
+        m = search(stripped, pos)
+        if m is None:
+            break
+        pos = m.end()
+        if m.lastgroup == 'end':
+            chunks.append((last, pos))
+            last = pos
+
+    if source[last:].strip():
+        chunks.append((last, len(source)))
+    elif chunks:
+        chunks[-1] = (chunks[-1][0], len(source))
+    return chunks
+
+
+def split_assignments(source, pos):
+    """ Find the assignments in a module body starting at offset pos of
+    source, without parsing them, by their '::=' outside of braces,
+    parentheses and brackets. Comments must have been stripped.
+
+    Returns a (assignments, end) tuple, where assignments is a list of
+    (kind, name, start, end, ambiguous) tuples, kind being 'TypeAssignment'
+    or 'ValueAssignment', and end is the offset of the END keyword closing
+    the module. ambiguous is True if the assignment's end is a guess, because
+    more than one word after it could be the name of the next assignment;
+    parse the assignment to find out where it really ends. Returns None if
+    the body is not well-formed enough to tell.
+    """
+    # Top-level units: tokens outside of brackets, and bracketed groups.
+    units = []
+    depth = 0
+    group_start = None
+    end = len(source)
+    match = _TOKEN_RE.match
+    while True:
+        if pos >= end:
+            return None
+
+        m = match(source, pos)
+        kind = m.lastgroup
+        start = pos
+        pos = m.end()
+        if kind == 'skip':
+            continue
+        elif kind == 'invalid':
+            return None
+        elif kind == 'cstring':
+            body_end = _CSTRING_BODY_RE.match(source, pos).end()
+            if not source.startswith('"', body_end):
+                return None
+            pos = body_end + 1
+
+        value = m.group()
+        if kind == 'punct' and value in '{([':
+            if depth == 0:
+                group_start = start
+            depth += 1
+        elif kind == 'punct' and value in '})]':
+            depth -= 1
+            if depth < 0:
+                return None
+            if depth == 0:
+                units.append(('group', None, group_start, pos))
+        elif depth == 0:
+            if kind == 'word' and value == 'END':
+                break
+            units.append((kind, value, start, pos))
+
+    module_end = start
+    colons = [i for i, unit in enumerate(units) if unit[1] == '::=']
+    if not colons:
+        return ([], module_end) if not units else None
+
+    # An assignment is 'Name ::= ...' or 'name Type ::= ...'. The right-hand
+    # side of one assignment runs up to the left-hand side of the next, which
+    # starts at the last lowercase word before its '::=', unless that would
+    # leave the previous right-hand side empty or cut it after a '.' or
+    # DEFINED BY. If other lowercase words before it could start the next
+    # left-hand side too, e.g. a named element in 'v SEQUENCE OF item
+    # INTEGER', the boundary is ambiguous.
+    starts = []
+    ambiguous = []
+    previous = -1
+    for colon in colons:
+        if previous < 0:
+            lhs = 0
+        else:
+            lhs = colon - 1
+            for i in range(colon - 1, previous + 1, -1):
+                if _is_lowercase_word(units[i]):
+                    if units[i - 1][1] not in ('.', 'DEFINED BY'):
+                        lhs = i
+                        # The type may be a selection type, 'name id < Type'.
+                        if units[i + 1][1] == '<' and i - 1 > previous + 1 and _is_lowercase_word(units[i - 1]):
+                            lhs = i - 1
+                    break
+
+        if lhs >= colon or lhs <= previous + 1 and previous >= 0:
+            return None
+        if lhs == colon - 1:
+            if units[lhs][0] != 'word' or _is_lowercase_word(units[lhs]):
+                return None
+        elif not _is_lowercase_word(units[lhs]):
+            return None
+        if previous >= 0:
+            ambiguous.append(any(_is_lowercase_word(units[i]) and units[i - 1][1] not in ('.', 'DEFINED BY')
+                                 for i in range(previous + 2, lhs)))
+        starts.append(lhs)
+        previous = colon
+    ambiguous.append(False)
+
+    if colons[-1] == len(units) - 1:
+        return None
+
+    assignments = []
+    for i, lhs in enumerate(starts):
+        last = starts[i + 1] - 1 if i + 1 < len(starts) else len(units) - 1
+        kind = 'TypeAssignment' if lhs == colons[i] - 1 else 'ValueAssignment'
+        assignments.append((kind, units[lhs][1], units[lhs][2], units[last][3], ambiguous[i]))
+    return assignments, module_end
+
+
+def _is_lowercase_word(unit):
+    return unit[0] == 'word' and unit[1][0].islower()
+
+
+def expand_tabs(source, start, text):
+    """ Return text, found at offset start in source, with its tabs expanded
+    the way source.expandtabs() would expand them.
+    """
+    if '\t' not in text:
+        return text
+    line_start = max(source.rfind('\n', 0, start), source.rfind('\r', 0, start)) + 1
+    prefix = source[line_start:start].expandtabs()
+    return (prefix + text).expandtabs()[len(prefix):]
+
+
+def blank(text):
+    """ Replace everything but tabs and line breaks in text with spaces, so
+    that offsets, lines and columns after it don't change.
+    """
+    return _BLANKED_RE.sub(' ', text)
+
+
+def _enclosing_word_end(source, pos):
+    """ If pos is inside a word, return the end offset of that word, else
+    None. Re-lexes the run of word characters leading up to pos. Reserved
+    words end before pos, like they end at a hyphen.
+    """
+    i = pos
+    while i > 0 and source[i - 1] in _WORD_CHARS:
+        i -= 1
+    while i < pos:
+        c = source[i]
+        if c.isalpha():
+            end = _WORD_RE.match(source, i).end()
+            if end > pos:
+                return None if source[i:pos] in RESERVED_WORDS else end
+            i = end
+        elif c.isdigit():
+            i = _NUMBER_RE.match(source, i).end()
+        else:
+            i += 1
+    return None
+
+
+def tokenize(source):
+    """ Split source into a list of Tokens, terminated by an 'eof' token.
+    Comments are not recognized here, pass the source through strip_comments
+    first.
+    Characters that do not start any valid token become 'invalid' tokens,
+    so errors are reported by the parser, at the point where they matter.
+    """
+    tokens = []
+    append = tokens.append
+    pos = 0
+    end = len(source)
+    match = _TOKEN_RE.match
+    while pos < end:
+        m = match(source, pos)
+        kind = m.lastgroup
+        if kind == 'skip':
+            pos = m.end()
+            continue
+
+        if kind == 'cstring':
+            body_end = _CSTRING_BODY_RE.match(source, m.end()).end()
+            if source.startswith('"', body_end):
+                value = expand_tabs(source, pos, source[pos:body_end + 1])
+                append(Token(kind, value, pos, body_end + 1))
+                pos = body_end + 1
+            else:
+                append(Token('invalid', '"', pos, pos + 1))
+                pos += 1
+            continue
+
+        value = m.group()
+        token_end = m.end()
+        if kind == 'word' and '--' in value:
+            # Like at a hyphen, a reserved word ends at a comment marker.
+            word = value[:value.index('--')]
+            if word in RESERVED_WORDS:
+                value = word
+                token_end = pos + len(word)
+        elif kind == 'number':
+            value = normalize_number(value)
+        elif kind in ('bstring', 'hstring'):
+            value = unquote_bitstring(value)
+        append(Token(kind, value, pos, token_end))
+        pos = token_end
+
+    append(Token('eof', '', end, end))
+    return tokens
+
+
+def normalize_number(text):
+    """ Exponents have always been spelled with a lowercase 'e' in parse
+    trees, keep it that way.
+    """
+    return text.replace('E', 'e')
+
+
+def unquote_bitstring(text):
+    """ Return the digits of a bstring or hstring literal, without quotes,
+    radix and whitespace.
+    """
+    return _WHITESPACE_RE.sub('', text[1:-2])
@@ -0,0 +1,234 @@
+# Copyright (c) 2013-2019, Schneider Electric Buildings AB
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Schneider Electric Buildings AB nor the
+#       names of contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+""" An on-disk cache of parse trees, keyed by a hash of the source text.
+
+Each cache entry holds the syntax trees of all modules in a source, with
+AnnotatedTokens stored as (ty, elements, start, end) tuples and serialized
+with marshal. The key covers everything that could change the trees or their
+serialization: the asn1ate version, the grammar version, the cache format
+and the Python and marshal versions.
+"""
+
+import os
+import sys
+import errno
+import marshal
+import hashlib
+import tempfile
+from asn1ate import __version__
+from asn1ate.parser import AnnotatedToken, GRAMMAR_VERSION
+
+__all__ = ['ParseCache', 'default_cache_dir']
+
+# Bump when the layout of cache entries changes.
+CACHE_FORMAT = 1
+
+_MAGIC = b'asn1ate-parse-cache\n'
+_ENTRY_SUFFIX = '.tree'
+_HASH_CHUNK = 1 << 20
+
+
+def default_cache_dir():
+    """ $ASN1ATE_CACHE_DIR, or asn1ate under the user's cache directory. """
+    cache_dir = os.environ.get('ASN1ATE_CACHE_DIR')
+    if cache_dir:
+        return cache_dir
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'asn1ate')
+
+
+class ParseCache(object):
+    """ A directory of cached parse trees, at most max_size bytes large.
+    When an entry is added and the cache grows beyond max_size, the least
+    recently used entries are removed.
+    """
+    def __init__(self, directory=None, max_size=64 * 1024 * 1024):
+        self.directory = directory or default_cache_dir()
+        self.max_size = max_size
+
+    def key(self, source):
+        """ Return the cache key of a source string. """
+        h = hashlib.sha256()
+        h.update(('asn1ate %s grammar %d cache %d python %d.%d marshal %d\n' %
+                  (__version__, GRAMMAR_VERSION, CACHE_FORMAT, sys.version_info[0],
+                   sys.version_info[1], marshal.version)).encode('ascii'))
+        for i in range(0, len(source), _HASH_CHUNK):
+            h.update(source[i:i + _HASH_CHUNK].encode('utf-8'))
+        return h.hexdigest()
+
+    def load(self, source):
+        """ Return the list of module syntax trees cached for source, or None
+        if there are none.
+        """
+        path = self._entry_path(self.key(source))
+        try:
+            with open(path, 'rb') as f:
+                if f.read(len(_MAGIC)) != _MAGIC:
+                    raise ValueError('Bad cache entry')
+                modules = [_decode(marshal.loads(module)) for module in marshal.load(f)]
+        except EnvironmentError:
+            return None
+        except (EOFError, ValueError, TypeError, IndexError):
+            # Truncated or otherwise broken, get rid of it.
+            _remove(path)
+            return None
+
+        # Mark as recently used.
+        try:
+            os.utime(path, None)
+        except EnvironmentError:
+            pass
+        return modules
+
+    def writer(self, source):
+        """ Return an EntryWriter to add the syntax trees for source to the
+        cache one module at a time.
+        """
+        return EntryWriter(self, self.key(source))
+
+    def store(self, source, modules):
+        """ Add the module syntax trees for source to the cache. """
+        writer = self.writer(source)
+        try:
+            for module in modules:
+                writer.add(module)
+            writer.commit()
+        finally:
+            writer.close()
+
+    def entries(self):
+        """ Return (path, size, mtime) for every entry in the cache. """
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except EnvironmentError:
+            return entries
+
+        for name in names:
+            if not name.endswith(_ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except EnvironmentError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def size(self):
+        """ Return the total size of all entries in bytes. """
+        return sum(size for _, size, _ in self.entries())
+
+    def clear(self):
+        """ Remove all entries. """
+        for path, _, _ in self.entries():
+            _remove(path)
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache is no
+        larger than max_size.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in sorted(entries, key=lambda entry: entry[2]):
+            if total <= self.max_size:
+                break
+            _remove(path)
+            total -= size
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key + _ENTRY_SUFFIX)
+
+
+class EntryWriter(object):
+    """ Serializes module syntax trees as they are added, so the trees
+    themselves need not be kept around until the entry is written. Nothing
+    is visible in the cache until commit is called.
+    """
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.modules = []
+
+    def add(self, module):
+        self.modules.append(marshal.dumps(_encode(module)))
+
+    def commit(self):
+        """ Atomically write the entry to the cache directory. """
+        directory = self.cache.directory
+        try:
+            os.makedirs(directory)
+        except EnvironmentError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_MAGIC)
+                marshal.dump(self.modules, f)
+            _replace(temp_path, self.cache._entry_path(self.key))
+        except:
+            _remove(temp_path)
+            raise
+
+        self.modules = []
+        self.cache.evict()
+
+    def close(self):
+        self.modules = []
+
+
+def _encode(node):
+    if type(node) is AnnotatedToken:
+        return (node.ty, _encode(node.elements), node.start, node.end)
+    elif type(node) is list:
+        return [_encode(element) for element in node]
+    return node
+
+
+def _decode(node):
+    if type(node) is tuple:
+        return AnnotatedToken(node[0], _decode(node[1]), node[2], node[3])
+    elif type(node) is list:
+        return [_decode(element) for element in node]
+    return node
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except EnvironmentError:
+        pass
+
+
+def _replace(src, dst):
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        # Python 2; rename doesn't replace on Windows.
+        _remove(dst)
+        os.rename(src, dst)
@@ -23,23 +23,469 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import io
 import re
+import sys
+import mmap
+import codecs
+import threading
+import contextlib
 from copy import copy
-from pyparsing import Keyword, Literal, Word, OneOrMore, ZeroOrMore, Combine, Regex, Forward, Optional, Group, Suppress, \
-    delimitedList, cStyleComment, nums, srange, dblQuotedString, Or, CaselessLiteral
+from timeit import default_timer
+from pyparsing import ParserElement, ParseException, Keyword, OneOrMore, ZeroOrMore, MatchFirst, Regex, Forward, \
+    Optional, Group, Suppress, delimitedList, dblQuotedString
+from asn1ate import lexer
 
-__all__ = ['parse_asn1', 'AnnotatedToken']
+__all__ = ['parse_asn1', 'parse_asn1_iter', 'split_modules', 'ParseSession', 'ParseProfile',
+           'packrat_cache_stats', 'parse_profile', 'AnnotatedToken', 'LazyAnnotatedToken', 'BACKENDS',
+           'GRAMMAR_VERSION']
 
+# Available parser engines for parse_asn1.
+BACKENDS = ('pyparsing', 'rd')
 
-def parse_asn1(asn1_definition):
+# Bump whenever the syntax trees produced by parse_asn1 change, so cached
+# trees (see asn1ate.parsecache) are not reused.
+GRAMMAR_VERSION = 1
+
+_TEXT_TYPES = (str, type(u''))
+
+
+def parse_asn1(asn1_definition, memoize=False, cache_size=128, backend='pyparsing', workers=1, encoding='utf-8',
+               cache=None, profile=False, lazy=False, token_factory=None):
     """ Parse a string containing one or more ASN.1 module definitions.
     Returns a list of module syntax trees represented as nested lists of
     AnnotatedToken objects.
+
+    Instead of a string, asn1_definition may also be a bytes-like object
+    (bytes, bytearray, memoryview, mmap), a file object or an os.PathLike
+    path, decoded with the given encoding and with line endings translated
+    to \\n as in text mode. Files are memory-mapped where possible, so the
+    text is decoded straight from the page cache without reading it into a
+    bytes object first.
+
+    backend selects the parser engine: 'pyparsing' for the pyparsing grammar
+    below, or 'rd' for the recursive-descent parser in asn1ate.rdparser.
+    Both produce the same syntax trees.
+
+    If memoize is True, use packrat parsing with a cache of at most
+    cache_size entries (None for unbounded) to avoid re-parsing the same
+    production at the same location after backtracking. Cache hit and miss
+    counts for the parse are available from packrat_cache_stats(). Memoization
+    only applies to the pyparsing backend. Packrat parsing is a process-wide
+    setting in pyparsing, so pyparsing parses in other threads wait while a
+    memoized parse runs.
+
+    If workers is not 1, the source is split at module boundaries and the
+    modules are parsed in parallel by a pool of that many processes (None for
+    one per CPU). This only pays off for sources with several large modules.
+
+    cache is an optional asn1ate.parsecache.ParseCache. If it holds the trees
+    for this source, they are returned without parsing, otherwise they are
+    added to it after parsing.
+
+    If profile is True, record attempts, matches, failures and time spent
+    for every production of the grammar, available from parse_profile()
+    after the parse. Profiling parses in this process without the cache, and
+    only applies to the pyparsing backend.
+
+    If lazy is True, assignments in module bodies are not parsed, only
+    located. They are LazyAnnotatedTokens, parsed when their elements are
+    first accessed, so syntax errors in an assignment are only reported
+    then. Lazy parsing happens in this process without the cache, and only
+    applies to the pyparsing backend.
+
+    token_factory, if given, is called as token_factory(ty, elements, start,
+    end) in place of AnnotatedToken for every node of the syntax trees, to
+    build some other tree straight from the parse (see
+    asn1ate.sema.parse_semantic_model). Parsing happens in this process
+    without the cache, and can't be lazy.
+    """
+    return list(parse_asn1_iter(asn1_definition, memoize, cache_size, backend, workers, encoding, cache,
+                                profile, lazy, token_factory))
+
+
+def parse_asn1_iter(asn1_definition, memoize=False, cache_size=128, backend='pyparsing', workers=1,
+                    encoding='utf-8', cache=None, profile=False, lazy=False, token_factory=None):
+    """ Like parse_asn1, but a generator yielding each module's syntax tree as
+    soon as the module has been parsed, so callers can process a module (and
+    let go of its syntax tree) before the next one is parsed.
+
+    As with parse_asn1, the first module must parse or ParseException is
+    raised. Parsing stops silently at the first module after that which
+    doesn't.
+    """
+    asn1_definition = _read_source(asn1_definition, encoding)
+
+    if profile:
+        global _profile
+        _profile = ParseProfile() if backend == 'pyparsing' else None
+    if lazy and token_factory is not None:
+        raise Exception('Lazy parsing can\'t be combined with a token factory')
+    if profile or lazy or token_factory is not None:
+        cache = None
+        workers = 1
+    token_factory = token_factory or AnnotatedToken
+
+    if cache is not None:
+        for module in _parse_cached(asn1_definition, memoize, cache_size, backend, workers, cache):
+            yield module
+        return
+
+    if workers != 1:
+        for module in _parse_parallel(asn1_definition, memoize, cache_size, backend, workers):
+            yield module
+        return
+
+    if backend == 'rd':
+        from asn1ate import rdparser
+        for module in rdparser.parse_asn1_iter(asn1_definition, token_factory):
+            yield module
+        return
+    elif backend != 'pyparsing':
+        raise Exception('Unknown parser backend: %s' % backend)
+
+    # Unlike parseString, we don't expand tabs (only in character strings,
+    # where it shows), so offsets refer to the original text.
+    stripped, _ = lexer.strip_comments(asn1_definition)
+
+    # The grammar is OneOrMore(module_definition), drive module_definition
+    # one module at a time instead.
+    module_definition = _get_asn1_grammar(profile, lazy).expr
+    if memoize:
+        _packrat_stats[:] = [0, 0]
+
+    loc = 0
+    first = True
+    while True:
+        try:
+            _parse_state.profile = _profile if profile else None
+            _parse_state.token_factory = token_factory
+            with _packrat(cache_size) if memoize else _packrat_guard.plain():
+                ParserElement.resetCache()
+                loc, tokens = module_definition._parse(stripped, loc)
+        except ParseException as e:
+            if not first:
+                return
+            # Report errors against the original text, comments and all.
+            raise ParseException(asn1_definition, e.loc, e.msg, e.parserElement)
+        except IndexError:
+            if not first:
+                return
+            raise
+
+        first = False
+        for module in tokens.asList():
+            yield module
+
+
+def _read_source(source, encoding):
+    """ Return the ASN.1 text in source, see parse_asn1.
+    """
+    if isinstance(source, _TEXT_TYPES):
+        return source
+
+    if hasattr(source, '__fspath__'):
+        with open(source.__fspath__(), 'rb') as f:
+            return _read_file(f, encoding)
+    elif hasattr(source, 'read'):
+        return _read_file(source, encoding)
+
+    return _decode(source, encoding)
+
+
+def _read_file(f, encoding):
+    if isinstance(f, io.TextIOBase):
+        return f.read()
+
+    try:
+        # Empty files and files that aren't files on disk can't be mapped.
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, EnvironmentError, ValueError, io.UnsupportedOperation):
+        return _decode(f.read(), encoding)
+
+    try:
+        return _decode(data, encoding)
+    finally:
+        data.close()
+
+
+def _decode(data, encoding):
+    """ Decode data like a file opened in text mode would, with \\r\\n and
+    \\r line endings translated to \\n.
+    """
+    text = codecs.getdecoder(encoding)(data)[0]
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def _parse_cached(asn1_definition, memoize, cache_size, backend, workers, cache):
+    modules = cache.load(asn1_definition)
+    if modules is not None:
+        for module in modules:
+            yield module
+        return
+
+    # Only store the trees if all modules were parsed and consumed.
+    writer = cache.writer(asn1_definition)
+    try:
+        for module in parse_asn1_iter(asn1_definition, memoize, cache_size, backend, workers):
+            writer.add(module)
+            yield module
+
+        try:
+            writer.commit()
+        except EnvironmentError:
+            # The cache is an optimization, don't fail the parse over it.
+            pass
+    finally:
+        writer.close()
+
+
+def _parse_parallel(asn1_definition, memoize, cache_size, backend, workers):
+    chunks = lexer.split_modules(asn1_definition)
+    if len(chunks) < 2:
+        for module in parse_asn1_iter(asn1_definition, memoize, cache_size, backend):
+            yield module
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    if memoize:
+        _packrat_stats[:] = [0, 0]
+
+    texts, offsets = _chunk_texts(asn1_definition, chunks)
+    n = len(chunks)
+    with ProcessPoolExecutor(workers) as executor:
+        results = executor.map(_parse_chunk, texts, offsets, [memoize] * n, [cache_size] * n, [backend] * n)
+        for i, result in enumerate(results):
+            if result is None:
+                if i == 0:
+                    # Parse in-process to raise the error against the full
+                    # source.
+                    for module in parse_asn1_iter(asn1_definition, memoize, cache_size, backend):
+                        yield module
+                # Like OneOrMore, stop at the first module that doesn't parse.
+                return
+
+            modules, stats = result
+            _packrat_stats[0] += stats[0]
+            _packrat_stats[1] += stats[1]
+            for module in modules:
+                yield module
+
+
+def split_modules(asn1_definition, encoding='utf-8'):
+    """ Split an ASN.1 definition into its module definitions, to be
+    parsed separately. asn1_definition may be anything parse_asn1
+    accepts. Returns the decoded text of the whole definition, and the
+    text of each module. Line and column numbers in a module's text are
+    the same as in the whole text.
     """
-    grammar = _build_asn1_grammar()
-    parse_result = grammar.parseString(asn1_definition)
-    parse_tree = parse_result.asList()
-    return parse_tree
+    asn1_definition = _read_source(asn1_definition, encoding)
+    texts, _ = _chunk_texts(asn1_definition, lexer.split_modules(asn1_definition))
+    return asn1_definition, texts
+
+
+def _chunk_texts(asn1_definition, chunks):
+    """ Return the texts and offsets of chunks as returned by
+    lexer.split_modules, to be parsed separately.
+    """
+    # Chunks may start in the middle of a line, start them at the beginning
+    # of the line, with the part that belongs to the previous module blanked
+    # out, so tabs in character strings expand the same.
+    texts = []
+    offsets = []
+    for start, end in chunks:
+        line_start = max(asn1_definition.rfind('\n', 0, start), asn1_definition.rfind('\r', 0, start)) + 1
+        texts.append(lexer.blank(asn1_definition[line_start:start]) + asn1_definition[start:end])
+        offsets.append(line_start)
+    return texts, offsets
+
+
+def _parse_chunk(chunk, offset, memoize, cache_size, backend):
+    """ Parse one module in a worker process. Returns a (modules,
+    packrat_stats) tuple, or None if the chunk doesn't parse.
+    """
+    try:
+        modules = parse_asn1(chunk, memoize, cache_size, backend)
+    except ParseException:
+        return None
+
+    for module in modules:
+        _shift_positions(module, offset)
+    return modules, packrat_cache_stats() if memoize else (0, 0)
+
+
+def _shift_positions(node, offset):
+    if type(node) is AnnotatedToken:
+        node.start += offset
+        node.end += offset
+        _shift_positions(node.elements, offset)
+    elif type(node) is list:
+        for element in node:
+            _shift_positions(element, offset)
+
+
+class ParseSession(object):
+    """ Parses successive versions of the same ASN.1 source, re-parsing only
+    the modules whose text changed since the previous parse. Meant for
+    editors and watch-mode builds that re-parse after every change.
+
+    The session remembers the text of each module definition from the
+    previous parse along with its syntax tree. Unchanged modules get their
+    previous tree back, with positions shifted if the module moved; these are
+    the same objects as returned before, so don't modify them.
+
+    Module boundaries are found with lexer.split_modules, so a change that
+    merges or splits modules (e.g. removing an END) just re-parses the
+    affected text.
+    """
+    def __init__(self, memoize=False, cache_size=128, backend='pyparsing'):
+        self.memoize = memoize
+        self.cache_size = cache_size
+        self.backend = backend
+        # Number of modules re-parsed and reused by the most recent parse.
+        self.reparsed = 0
+        self.reused = 0
+        self._modules = {}
+
+    def parse(self, asn1_definition, encoding='utf-8'):
+        """ Parse asn1_definition like parse_asn1 and return the list of
+        module syntax trees.
+        """
+        asn1_definition = _read_source(asn1_definition, encoding)
+        texts, offsets = _chunk_texts(asn1_definition, lexer.split_modules(asn1_definition))
+
+        self.reparsed = self.reused = 0
+        previous = self._modules
+        self._modules = {}
+        result = []
+        for i, (text, offset) in enumerate(zip(texts, offsets)):
+            # Each tree can only be reused once, even if the same text occurs
+            # more than once.
+            entries = previous.get(text)
+            if entries:
+                old_offset, modules = entries.pop(0)
+                if offset != old_offset:
+                    for module in modules:
+                        _shift_positions(module, offset - old_offset)
+                self.reused += 1
+            else:
+                try:
+                    modules = parse_asn1(text, self.memoize, self.cache_size, self.backend)
+                except ParseException:
+                    if i == 0:
+                        # Raise the error against the full source.
+                        self._modules = {}
+                        return parse_asn1(asn1_definition, self.memoize, self.cache_size, self.backend)
+                    # Like OneOrMore, stop at the first module that doesn't
+                    # parse.
+                    break
+                for module in modules:
+                    _shift_positions(module, offset)
+                self.reparsed += 1
+
+            self._modules.setdefault(text, []).append((offset, modules))
+            result.extend(modules)
+
+        if not result:
+            # Nothing but whitespace, let parse_asn1 complain.
+            return parse_asn1(asn1_definition, self.memoize, self.cache_size, self.backend)
+        return result
+
+    def clear(self):
+        """ Forget all modules, so the next parse starts from scratch. """
+        self._modules = {}
+
+
+class ParseProfile(object):
+    """ Per-production statistics of a profiled parse, see parse_asn1.
+    productions maps the name of each production in the grammar that was
+    attempted to its ProductionStats. Productions with several names in the
+    grammar are listed under all of them, separated by '/'.
+    """
+    SORT_KEYS = ('cumtime', 'tottime', 'failtime', 'attempts', 'failures')
+
+    def __init__(self):
+        self.productions = {}
+        self._stack = []
+
+    def report(self, sort='cumtime', limit=None, out=None):
+        """ Print a table of the productions, most expensive by sort first.
+        """
+        out = out or sys.stdout
+        productions = sorted(self.productions.values(), key=lambda p: getattr(p, sort), reverse=True)
+        out.write('%-36s %9s %9s %9s %6s %10s %10s %10s\n' %
+                  ('Production', 'Attempts', 'Matches', 'Failures', 'Fail%',
+                   'Own (ms)', 'Cum (ms)', 'Fail (ms)'))
+        for p in productions[:limit]:
+            out.write('%-36s %9d %9d %9d %5.0f%% %10.2f %10.2f %10.2f\n' %
+                      (p.name, p.attempts, p.matches, p.failures, 100.0 * p.failures / p.attempts,
+                       p.tottime * 1000, p.cumtime * 1000, p.failtime * 1000))
+
+    def totals(self):
+        """ Return the total (attempts, failures) of all productions. Every
+        failure is an attempt that was backtracked.
+        """
+        return (sum(p.attempts for p in self.productions.values()),
+                sum(p.failures for p in self.productions.values()))
+
+    def _enter(self, name):
+        stats = self.productions.get(name)
+        if stats is None:
+            stats = self.productions[name] = ProductionStats(name)
+        stats.attempts += 1
+        stats.depth += 1
+        self._stack.append([stats, default_timer(), 0.0])
+
+    def _exit(self, matched):
+        stats, start, child_time = self._stack.pop()
+        elapsed = default_timer() - start
+        stats.tottime += elapsed - child_time
+        stats.depth -= 1
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+        # Like cProfile, only count the outermost of recursive attempts in the
+        # cumulative times.
+        if matched:
+            stats.matches += 1
+        else:
+            stats.failures += 1
+        if stats.depth == 0:
+            stats.cumtime += elapsed
+            if not matched:
+                stats.failtime += elapsed
+
+
+class ProductionStats(object):
+    """ Statistics for one production: the number of attempts to match it,
+    how many matched and failed, the time spent in the production itself
+    (tottime) and including the productions it tried (cumtime) and the part of
+    cumtime spent in attempts that failed and were backtracked (failtime).
+    """
+    __slots__ = ('name', 'attempts', 'matches', 'failures', 'tottime', 'cumtime', 'failtime', 'depth')
+
+    def __init__(self, name):
+        self.name = name
+        self.attempts = self.matches = self.failures = 0
+        self.tottime = self.cumtime = self.failtime = 0.0
+        self.depth = 0
+
+
+def parse_profile():
+    """ Return the ParseProfile of the most recent profiled parse_asn1 or
+    parse_asn1_iter call, or None if there was none.
+    """
+    return _profile
+
+
+def packrat_cache_stats():
+    """ Return a (hits, misses) tuple for the packrat cache during the
+    most recent memoized parse_asn1 or parse_asn1_iter call.
+    """
+    return tuple(_packrat_stats)
 
 
 def print_parse_tree(node, indent=1):
@@ -68,12 +514,16 @@ class AnnotatedToken(object):
     """ A simple data structure to keep track of a token's
     type, identified by a string, and its children.
     Children may be other annotated tokens, lists or simple
-    strings.
+    strings. start and end are the offsets of the token's
+    text in the parsed source, if known.
     """
+    __slots__ = ('ty', 'elements', 'start', 'end')
 
-    def __init__(self, token_type, elements):
+    def __init__(self, token_type, elements, start=None, end=None):
         self.ty = token_type
         self.elements = elements
+        self.start = start
+        self.end = end
 
     def __str__(self):
         return 'T(%s)%s' % (self.ty, self.elements)
@@ -81,21 +531,195 @@ class AnnotatedToken(object):
     __repr__ = __str__
 
 
-def _build_asn1_grammar():
-    def build_identifier(prefix_pattern):
-        identifier_suffix = Optional(Word(srange('[-0-9a-zA-Z]')))
+# The element slot of AnnotatedToken, shadowed by LazyAnnotatedToken.elements.
+_elements_slot = AnnotatedToken.elements
+
+
+class LazyAnnotatedToken(AnnotatedToken):
+    """ An assignment found by a lazy parse, see parse_asn1. ty, start and
+    end are known up front, as is name, the assignment's reference name. The
+    assignment is parsed when elements is first accessed.
+    """
+    __slots__ = ('name', '_source', '_production')
+
+    def __init__(self, token_type, name, start, end, source, production):
+        self.ty = token_type
+        self.name = name
+        self.start = start
+        self.end = end
+        self._source = source
+        self._production = production
+
+    @property
+    def parsed(self):
+        return self._source is None
+
+    @property
+    def elements(self):
+        if self._source is not None:
+            with _packrat_guard.plain():
+                self._parse()
+        return _elements_slot.__get__(self, LazyAnnotatedToken)
+
+    def _parse(self):
+        _parse_state.token_factory = AnnotatedToken
+        _, tokens = self._production._parse(self._source, self.start)
+        token = tokens[0]
+        if token.ty != self.ty or token.end != self.end:
+            raise ParseException(self._source, token.end, 'Expected end of %s' % self.name,
+                                 self._production)
+        _elements_slot.__set__(self, token.elements)
+        self._source = self._production = None
+
+
+# The grammar is expensive to build and immutable once built, so we build it
+# once per process on first use and share it between all parse_asn1 calls.
+# Grammars are keyed by their (profile, lazy) options; the token factory is
+# passed to the parse actions per parse, in _parse_state.
+_asn1_grammars = {}
+_asn1_grammar_lock = threading.Lock()
+
+
+def _get_asn1_grammar(profile=False, lazy=False):
+    """ Return the process-wide ASN.1 grammar, building it on first use.
+    With profile, return the separate grammar that records a ParseProfile,
+    with lazy the one that leaves assignments unparsed.
+    """
+    key = (bool(profile), bool(lazy))
+    grammar = _asn1_grammars.get(key)
+    if grammar is None:
+        with _asn1_grammar_lock:
+            grammar = _asn1_grammars.get(key)
+            if grammar is None:
+                grammar = _build_asn1_grammar(profile=profile, lazy=lazy)
+                grammar.streamline()
+                _asn1_grammars[key] = grammar
+
+    return grammar
+
+
+# Per-thread state of the parse actions.
+_parse_state = threading.local()
+
+# The ParseProfile of the most recent profiled parse.
+_profile = None
+
+
+class _PackratGuard(object):
+    """ Packrat parsing is a global setting in pyparsing, so a memoized parse
+    must not overlap with any other parse. Any number of plain parses may run
+    at the same time, or one memoized parse on its own. Memoized parses
+    waiting for their turn keep new plain parses from starting.
+    """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._plain = 0
+        self._memoized = False
+        self._waiting = 0
+
+    @contextlib.contextmanager
+    def plain(self):
+        with self._condition:
+            while self._memoized or self._waiting:
+                self._condition.wait()
+            self._plain += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._plain -= 1
+                if not self._plain:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def memoized(self):
+        with self._condition:
+            self._waiting += 1
+            while self._memoized or self._plain:
+                self._condition.wait()
+            self._waiting -= 1
+            self._memoized = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._memoized = False
+                self._condition.notify_all()
+
+
+# Every pyparsing parse in this module runs under the guard, memoized ones
+# restore the previous packrat setting when they are done.
+_packrat_guard = _PackratGuard()
+_packrat_stats = [0, 0]
+
+
+@contextlib.contextmanager
+def _packrat(cache_size):
+    with _packrat_guard.memoized():
+        was_enabled = ParserElement._packratEnabled
+        prev_parse = ParserElement._parse
+        prev_cache = ParserElement.packrat_cache
+
+        ParserElement._packratEnabled = False
+        ParserElement.enablePackrat(cache_size)
+        try:
+            yield
+        finally:
+            _packrat_stats[0] += ParserElement.packrat_cache_stats[0]
+            _packrat_stats[1] += ParserElement.packrat_cache_stats[1]
+            ParserElement.packrat_cache.clear()
+            ParserElement._packratEnabled = was_enabled
+            ParserElement._parse = prev_parse
+            ParserElement.packrat_cache = prev_cache
+
+
+def _build_asn1_grammar(profile=False, lazy=False):
+    def build_identifier(pattern):
         # todo: more rigorous? trailing hyphens and -- forbidden
-        return Combine(Word(srange(prefix_pattern), exact=1) + identifier_suffix)
+        return Regex(pattern)
+
+    def keyword_set(*keywords):
+        # Match any of several reserved words in one regex
+        return Regex(lexer.keywords_pattern(keywords))
+
+    def normalize_number(t):
+        return lexer.normalize_number(t[0])
+
+    def unquote_bitstring(t):
+        return lexer.unquote_bitstring(t[0])
 
     def braced_list(element_rule):
         elements_rule = Optional(delimitedList(element_rule))
         return Suppress('{') + Group(elements_rule) + Suppress('}')
 
-    def annotate(name):
-        def annotation(t):
-            return AnnotatedToken(name, t.asList())
+    def annotate(element, name, *actions):
+        # Mark up the element's parse results, after any other actions, as an
+        # AnnotatedToken (or whatever the parse's token_factory makes)
+        # covering the matched text. Parse actions only get the start offset,
+        # so the end is recorded by postParse, which runs right before them.
+        post_parse = element.postParse
 
-        return annotation
+        def record_end(instring, loc, tokens):
+            _parse_state.end = loc
+            return post_parse(instring, loc, tokens)
+
+        def annotation(s, loc, t):
+            # Expressions don't skip leading whitespace before they report
+            # the start, and trailing optional elements that didn't match
+            # leave the end after the whitespace following the match.
+            start = loc
+            while start < len(s) and s[start] in ' \t\r\n':
+                start += 1
+            end = _parse_state.end
+            while end > start and s[end - 1] in ' \t\r\n':
+                end -= 1
+            return _parse_state.token_factory(name, t.asList(), start, max(start, end))
+
+        element.postParse = record_end
+        element.setParseAction(*(actions + (annotation,)))
+
+    def expand_tabs(s, loc, t):
+        return lexer.expand_tabs(s, loc, t[0])
 
     # Reserved words
     ANY = Keyword('ANY')
@@ -105,18 +729,10 @@ def _build_asn1_grammar():
     END = Keyword('END')
     OPTIONAL = Keyword('OPTIONAL')
     DEFAULT = Keyword('DEFAULT')
-    TRUE = Keyword('TRUE')
-    FALSE = Keyword('FALSE')
-    UNIVERSAL = Keyword('UNIVERSAL')
-    APPLICATION = Keyword('APPLICATION')
-    PRIVATE = Keyword('PRIVATE')
     MIN = Keyword('MIN')
     MAX = Keyword('MAX')
     IMPLICIT = Keyword('IMPLICIT')
     EXPLICIT = Keyword('EXPLICIT')
-    EXPLICIT_TAGS = Keyword('EXPLICIT TAGS')
-    IMPLICIT_TAGS = Keyword('IMPLICIT TAGS')
-    AUTOMATIC_TAGS = Keyword('AUTOMATIC TAGS')
     EXTENSIBILITY_IMPLIED = Keyword('EXTENSIBILITY IMPLIED')
     COMPONENTS_OF = Keyword('COMPONENTS OF')
     ELLIPSIS = Keyword('...')
@@ -141,61 +757,46 @@ def _build_asn1_grammar():
     OBJECT_IDENTIFIER = Keyword('OBJECT IDENTIFIER')
 
     # Restricted string types
-    BMPString = Keyword('BMPString')
-    GeneralString = Keyword('GeneralString')
-    GraphicString = Keyword('GraphicString')
-    IA5String = Keyword('IA5String')
-    ISO646String = Keyword('ISO646String')
-    NumericString = Keyword('NumericString')
-    PrintableString = Keyword('PrintableString')
-    TeletexString = Keyword('TeletexString')
-    T61String = Keyword('T61String')
-    UniversalString = Keyword('UniversalString')
-    UTF8String = Keyword('UTF8String')
-    VideotexString = Keyword('VideotexString')
-    VisibleString = Keyword('VisibleString')
+    restricted_string_types = ['BMPString', 'GeneralString', 'GraphicString', 'IA5String',
+                               'ISO646String', 'NumericString', 'PrintableString',
+                               'TeletexString', 'T61String', 'UniversalString',
+                               'UTF8String', 'VideotexString', 'VisibleString']
+    RESTRICTED_STRING = keyword_set(*restricted_string_types)
 
     # Useful types
-    GeneralizedTime = Keyword('GeneralizedTime')
-    UTCTime = Keyword('UTCTime')
-    ObjectDescriptor = Keyword('ObjectDescriptor')
+    useful_types = ['GeneralizedTime', 'UTCTime', 'ObjectDescriptor']
+    USEFUL_TYPE = keyword_set(*useful_types)
 
     # Literals
-    number = Word(nums)
-    signed_number = Combine(Optional('-') + number)  # todo: consider defined values from 18.1
-    bstring = Suppress('\'') + StringOf('01') + Suppress('\'B')
-    hstring = Suppress('\'') + StringOf('0123456789ABCDEF') + Suppress('\'H')
-
-    # Comments
-    hyphen_comment = Regex(r"--[\s\S]*?(--|$)", flags=re.MULTILINE)
-    comment = hyphen_comment | cStyleComment
+    number = Regex(lexer.NUMBER)
+    signed_number = Regex(lexer.SIGNED_NUMBER)  # todo: consider defined values from 18.1
+    bstring = Regex(lexer.BSTRING)
+    hstring = Regex(lexer.HSTRING)
 
     # identifier
-    identifier = build_identifier('[a-z]')
+    identifier = build_identifier(lexer.VALUEREFERENCE)
 
     # references
     # these are duplicated to force unique token annotations
-    valuereference = build_identifier('[a-z]')
-    typereference = build_identifier('[A-Z]')
-    module_reference = build_identifier('[A-Z]')
+    valuereference = build_identifier(lexer.VALUEREFERENCE)
+    typereference = build_identifier(lexer.TYPEREFERENCE)
+    module_reference = build_identifier(lexer.TYPEREFERENCE)
     reference = valuereference | typereference  # TODO: consider object references from 12.1
 
     # values
     # todo: consider more literals from 16.9
-    boolean_value = TRUE | FALSE
+    boolean_value = keyword_set('TRUE', 'FALSE')
     bitstring_value = bstring | hstring  # todo: consider more forms from 21.9
     integer_value = signed_number
     null_value = NULL
-    cstring_value = dblQuotedString
+    cstring_value = dblQuotedString.copy().setParseAction(expand_tabs)
 
-    exponent = CaselessLiteral('e') + signed_number
-    real_value = Combine(signed_number + Optional(Literal('.') + Optional(number)) + Optional(exponent))
+    real_value = Regex(lexer.REAL_NUMBER).setParseAction(normalize_number)
 
     # In value range constraints, decimal points must be followed by number, or
     # the grammar becomes ambiguous: ([1.].100) vs ([1]..[100])
-    constraint_real_value = Combine(signed_number + Optional(Literal('.') + number) + Optional(exponent))
+    constraint_real_value = Regex(lexer.CONSTRAINT_REAL_NUMBER).setParseAction(normalize_number)
 
-    builtin_value = boolean_value | bitstring_value | real_value | integer_value | null_value | cstring_value
     external_value_reference = module_reference + Suppress('.') + valuereference
     defined_value = external_value_reference | valuereference  # todo: more options from 13.1
     referenced_value = Unique(defined_value)  # todo: more options from 16.11
@@ -210,7 +811,18 @@ def _build_asn1_grammar():
                               (objid_components_list | (defined_value + objid_components_list)) + \
                               Suppress('}')
 
-    value = builtin_value | referenced_value | object_identifier_value
+    # Pick the alternative from the next token. real_value also matches all
+    # integers, integer_value is kept for order only.
+    value = Dispatch([
+        (boolean_value, ['TRUE', 'FALSE']),
+        (bitstring_value, ["'"]),
+        (real_value, [Dispatch.NUMBER]),
+        (integer_value, [Dispatch.NUMBER]),
+        (null_value, ['NULL']),
+        (cstring_value, ['"']),
+        (referenced_value, [Dispatch.WORD]),
+        (object_identifier_value, ['{']),
+    ])
 
     # definitive identifier value
     definitive_number_form = Unique(number)
@@ -220,10 +832,10 @@ def _build_asn1_grammar():
     definitive_identifier = Optional(Suppress('{') + definitive_objid_component_list + Suppress('}'))
 
     # tags
-    class_ = UNIVERSAL | APPLICATION | PRIVATE
+    class_ = keyword_set('UNIVERSAL', 'APPLICATION', 'PRIVATE')
     class_number = Unique(number)  # todo: consider defined values from 30.1
     tag = Suppress('[') + Optional(class_) + class_number + Suppress(']')
-    tag_default = EXPLICIT_TAGS | IMPLICIT_TAGS | AUTOMATIC_TAGS
+    tag_default = keyword_set('EXPLICIT TAGS', 'IMPLICIT TAGS', 'AUTOMATIC TAGS')
 
     # extensions
     extension_default = Unique(EXTENSIBILITY_IMPLIED)
@@ -280,24 +892,42 @@ def _build_asn1_grammar():
     object_identifier_type = OBJECT_IDENTIFIER
     octetstring_type = OCTET_STRING + Optional(size_constraint)
     unrestricted_characterstring_type = CHARACTER_STRING
-    restricted_characterstring_type = BMPString | GeneralString | \
-                                      GraphicString | IA5String | \
-                                      ISO646String | NumericString | \
-                                      PrintableString | TeletexString | \
-                                      T61String | UniversalString | \
-                                      UTF8String | VideotexString | \
-                                      VisibleString
+    restricted_characterstring_type = RESTRICTED_STRING
     characterstring_type = (restricted_characterstring_type | unrestricted_characterstring_type) + Optional(size_constraint)
-    useful_type = GeneralizedTime | UTCTime | ObjectDescriptor
+    useful_type = USEFUL_TYPE
 
     # ANY type
     any_type = ANY + Optional(Suppress(DEFINED_BY + identifier))
 
     # todo: consider other builtins from 16.2
-    simple_type = (any_type | boolean_type | null_type | octetstring_type | characterstring_type | real_type | integer_type | object_identifier_type | useful_type) + Optional(value_range_constraint | single_value_constraint)
+    simple_type_keywords = ['ANY', 'BOOLEAN', 'NULL', 'OCTET', 'CHARACTER', 'REAL', 'INTEGER', 'OBJECT'] + \
+                           restricted_string_types + useful_types
+    simple_type = Dispatch([
+        (any_type, ['ANY']),
+        (boolean_type, ['BOOLEAN']),
+        (null_type, ['NULL']),
+        (octetstring_type, ['OCTET']),
+        (characterstring_type, restricted_string_types + ['CHARACTER']),
+        (real_type, ['REAL']),
+        (integer_type, ['INTEGER']),
+        (object_identifier_type, ['OBJECT']),
+        (useful_type, useful_types),
+    ]) + Optional(value_range_constraint | single_value_constraint)
     constructed_type = choice_type | sequence_type | set_type
     value_list_type = restricted_integer_type | enumerated_type
-    builtin_type = value_list_type | tagged_type | simple_type | constructed_type | sequenceof_type | setof_type | bitstring_type
+    # The alternatives in order of precedence, tried only if they can start
+    # with the next token. SEQUENCE and SET are followed by a brace in
+    # constructed types but not in SEQUENCE OF and SET OF, same for INTEGER
+    # with and without named numbers.
+    builtin_type = Dispatch([
+        (value_list_type, ['INTEGER {', 'ENUMERATED']),
+        (tagged_type, ['[']),
+        (simple_type, simple_type_keywords + ['INTEGER {']),
+        (constructed_type, ['CHOICE', 'SEQUENCE {', 'SET {']),
+        (sequenceof_type, ['SEQUENCE']),
+        (setof_type, ['SET']),
+        (bitstring_type, ['BIT']),
+    ])
 
     referenced_type = defined_type | selection_type  # todo: consider other ref:d types from 16.3
 
@@ -309,6 +939,8 @@ def _build_asn1_grammar():
 
     assignment = type_assignment | value_assignment
     assignment_list = ZeroOrMore(assignment)
+    if lazy:
+        assignment_list = LazyAssignmentList(assignment, assignment_list)
 
     # TODO: Maybe handle full assigned-identifier syntax with defined values
     # described in 12.1, but I haven't been able to find examples of it, and I
@@ -329,68 +961,107 @@ def _build_asn1_grammar():
                         Optional(extension_default, default=None) + Suppress('::=') + \
                         Suppress(BEGIN) + module_body + Suppress(END)
 
-    module_definition.ignore(comment)
+    # Comments are blanked out by lexer.strip_comments before parsing, so the
+    # grammar does not need to ignore() them between every pair of tokens.
 
     # Mark up the parse results with token tags
-    identifier.setParseAction(annotate('Identifier'))
-    named_number_value.setParseAction(annotate('Value'))
-    tag.setParseAction(annotate('Tag'))
-    class_.setParseAction(annotate('TagClass'))
-    class_number.setParseAction(annotate('TagClassNumber'))
-    type_.setParseAction(annotate('Type'))
-    simple_type.setParseAction(annotate('SimpleType'))
-    choice_type.setParseAction(annotate('ChoiceType'))
-    sequence_type.setParseAction(annotate('SequenceType'))
-    set_type.setParseAction(annotate('SetType'))
-    value_list_type.setParseAction(annotate('ValueListType'))
-    bitstring_type.setParseAction(annotate('BitStringType'))
-    sequenceof_type.setParseAction(annotate('SequenceOfType'))
-    setof_type.setParseAction(annotate('SetOfType'))
-    named_number.setParseAction(annotate('NamedValue'))
-    named_nonumber.setParseAction(annotate('NamedValue'))
-    single_value_constraint.setParseAction(annotate('SingleValueConstraint'))
-    size_constraint.setParseAction(annotate('SizeConstraint'))
-    value_range_constraint.setParseAction(annotate('ValueRangeConstraint'))
-    component_type.setParseAction(annotate('ComponentType'))
-    component_type_optional.setParseAction(annotate('ComponentTypeOptional'))
-    component_type_default.setParseAction(annotate('ComponentTypeDefault'))
-    component_type_components_of.setParseAction(annotate('ComponentTypeComponentsOf'))
-    tagged_type.setParseAction(annotate('TaggedType'))
-    named_type.setParseAction(annotate('NamedType'))
-    type_assignment.setParseAction(annotate('TypeAssignment'))
-    value_assignment.setParseAction(annotate('ValueAssignment'))
-    module_reference.setParseAction(annotate('ModuleReference'))
-    global_module_reference.setParseAction(annotate('GlobalModuleReference'))
-    module_body.setParseAction(annotate('ModuleBody'))
-    module_definition.setParseAction(annotate('ModuleDefinition'))
-    extension_marker.setParseAction(annotate('ExtensionMarker'))
-    name_form.setParseAction(annotate('NameForm'))
-    number_form.setParseAction(annotate('NumberForm'))
-    name_and_number_form.setParseAction(annotate('NameAndNumberForm'))
-    object_identifier_value.setParseAction(annotate('ObjectIdentifierValue'))
-    definitive_identifier.setParseAction(annotate('DefinitiveIdentifier'))
-    definitive_number_form.setParseAction(annotate('DefinitiveNumberForm'))
-    definitive_name_and_number_form.setParseAction(annotate('DefinitiveNameAndNumberForm'))
-    exports.setParseAction(annotate('Exports'))
-    imports.setParseAction(annotate('Imports'))
-    assignment_list.setParseAction(annotate('AssignmentList'))
-    bstring.setParseAction(annotate('BinaryStringValue'))
-    hstring.setParseAction(annotate('HexStringValue'))
-    defined_type.setParseAction(annotate('DefinedType'))
-    selection_type.setParseAction(annotate('SelectionType'))
-    referenced_value.setParseAction(annotate('ReferencedValue'))
+    annotate(identifier, 'Identifier')
+    annotate(named_number_value, 'Value')
+    annotate(tag, 'Tag')
+    annotate(class_, 'TagClass')
+    annotate(class_number, 'TagClassNumber')
+    annotate(type_, 'Type')
+    annotate(simple_type, 'SimpleType')
+    annotate(choice_type, 'ChoiceType')
+    annotate(sequence_type, 'SequenceType')
+    annotate(set_type, 'SetType')
+    annotate(value_list_type, 'ValueListType')
+    annotate(bitstring_type, 'BitStringType')
+    annotate(sequenceof_type, 'SequenceOfType')
+    annotate(setof_type, 'SetOfType')
+    annotate(named_number, 'NamedValue')
+    annotate(named_nonumber, 'NamedValue')
+    annotate(single_value_constraint, 'SingleValueConstraint')
+    annotate(size_constraint, 'SizeConstraint')
+    annotate(value_range_constraint, 'ValueRangeConstraint')
+    annotate(component_type, 'ComponentType')
+    annotate(component_type_optional, 'ComponentTypeOptional')
+    annotate(component_type_default, 'ComponentTypeDefault')
+    annotate(component_type_components_of, 'ComponentTypeComponentsOf')
+    annotate(tagged_type, 'TaggedType')
+    annotate(named_type, 'NamedType')
+    annotate(type_assignment, 'TypeAssignment')
+    annotate(value_assignment, 'ValueAssignment')
+    annotate(module_reference, 'ModuleReference')
+    annotate(global_module_reference, 'GlobalModuleReference')
+    annotate(module_body, 'ModuleBody')
+    annotate(module_definition, 'ModuleDefinition')
+    annotate(extension_marker, 'ExtensionMarker')
+    annotate(name_form, 'NameForm')
+    annotate(number_form, 'NumberForm')
+    annotate(name_and_number_form, 'NameAndNumberForm')
+    annotate(object_identifier_value, 'ObjectIdentifierValue')
+    annotate(definitive_identifier, 'DefinitiveIdentifier')
+    annotate(definitive_number_form, 'DefinitiveNumberForm')
+    annotate(definitive_name_and_number_form, 'DefinitiveNameAndNumberForm')
+    annotate(exports, 'Exports')
+    annotate(imports, 'Imports')
+    annotate(assignment_list, 'AssignmentList')
+    annotate(bstring, 'BinaryStringValue', unquote_bitstring)
+    annotate(hstring, 'HexStringValue', unquote_bitstring)
+    annotate(defined_type, 'DefinedType')
+    annotate(selection_type, 'SelectionType')
+    annotate(referenced_value, 'ReferencedValue')
+
+    if profile:
+        _add_profiling(locals())
 
     start = OneOrMore(module_definition)
     return start
 
 
+def _add_profiling(productions):
+    """ Make every ParserElement in productions, a dict of grammar variables,
+    record its attempts in the ParseProfile of the current parse. This has to
+    happen before the grammar is streamlined, or nested productions without
+    parse actions are merged into their parents.
+    """
+    names = {}
+    for name, element in productions.items():
+        if isinstance(element, ParserElement):
+            names.setdefault(id(element), (element, []))[1].append(name)
+
+    for element, aliases in names.values():
+        element.setDebugActions(*_profiling_actions('/'.join(sorted(aliases))))
+
+
+def _profiling_actions(name):
+    # pyparsing 3 passes the debug actions a trailing cache_hit flag.
+    def enter(instring, loc, expr, *args):
+        profile = _parse_state.profile
+        if profile is not None:
+            profile._enter(name)
+
+    def match(instring, start, loc, expr, tokens, *args):
+        profile = _parse_state.profile
+        if profile is not None:
+            profile._exit(True)
+
+    def fail(instring, start, expr, exc, *args):
+        profile = _parse_state.profile
+        if profile is not None:
+            profile._exit(False)
+
+    return enter, match, fail
+
+
 def Unique(token):
     """ Use to create a distinct name of a production
     with the same form as another, e.g.
-      identifier = build_identifier('[a-z]')
-      valuereference = build_identifier('[a-z]')
+      identifier = build_identifier(lexer.VALUEREFERENCE)
+      valuereference = build_identifier(lexer.VALUEREFERENCE)
     We prefer:
-      identifier = build_identifier('[a-z]')
+      identifier = build_identifier(lexer.VALUEREFERENCE)
       valuereference = Unique(identifier)
     to avoid duplicating the details of the grammar.
     This allows unique parse actions for productions
@@ -399,20 +1070,116 @@ def Unique(token):
     return copy(token)
 
 
-def StringOf(elements):
-    """ Create a rule to parse a string of any of the chars in elements.
-    Skips any whitespace.
-    This is useful for the ASN.1 hstring and bstring productions.
+class LazyAssignmentList(ParserElement):
+    """ Matches the assignments of a module body without parsing them, as
+    LazyAnnotatedTokens that parse themselves with assignment on demand.
+    Bodies that lexer.split_assignments can't make sense of are parsed with
+    assignment_list instead, which also reports errors as usual. So are
+    bodies where an assignment whose end split_assignments had to guess
+    turns out to end elsewhere; those assignments are parsed right away to
+    check.
     """
-    element = CharSet(elements)
-    return Combine(OneOrMore(element), adjacent=False)  # Use adjacent=False to skip whitespace
+    def __init__(self, assignment, assignment_list):
+        super(LazyAssignmentList, self).__init__()
+        self.assignment = assignment
+        self.assignment_list = assignment_list
+        self.mayReturnEmpty = True
+        self.errmsg = assignment_list.errmsg
+
+    def parseImpl(self, instring, loc, doActions=True):
+        result = lexer.split_assignments(instring, loc)
+        if result is None:
+            return self.assignment_list._parse(instring, loc, doActions)
+
+        assignments, _ = result
+        tokens = []
+        for kind, name, start, end, ambiguous in assignments:
+            token = LazyAnnotatedToken(kind, name, start, end, instring, self.assignment)
+            if ambiguous:
+                try:
+                    token._parse()
+                except ParseException:
+                    return self.assignment_list._parse(instring, loc, doActions)
+            tokens.append(token)
+        return (assignments[-1][3] if assignments else loc), tokens
+
+    def streamline(self):
+        super(LazyAssignmentList, self).streamline()
+        self.assignment.streamline()
+        self.assignment_list.streamline()
+        return self
+
+    def _generateDefaultName(self):
+        # Abstract in pyparsing 3, which names elements with it.
+        return 'LazyAssignmentList(%s)' % self.assignment
 
+    __str__ = _generateDefaultName
 
-def CharSet(elements):
-    """ Create a set of valid characters as a single rule.
-    elements is a string containing all the desired chars, e.g.
-      CharSet('01234567890')        # all numbers
-      CharSet('01234567890ABCDEF')  # all hex numbers
+
+class Dispatch(MatchFirst):
+    """ A MatchFirst that looks at the next token to decide which of its
+    alternatives to try, instead of trying them all in order. Use for
+    alternations that are mostly told apart by a leading reserved word or
+    punctuation, to avoid backtracking.
+
+    alternatives is a list of (element, first) pairs in order of precedence,
+    where first lists every token element can start with: reserved words
+    (for multi-word ones, the first word), punctuation characters, a word
+    followed by an opening brace ('SET {'), WORD for any word or NUMBER for
+    any number. The first matching alternative among the ones that can start
+    with the next token wins, so the result is the same as with MatchFirst.
     """
-    unpacked_chars = [Literal(c) for c in elements]
-    return Or(unpacked_chars)
+    WORD = '<word>'
+    NUMBER = '<number>'
+
+    # Words end where pyparsing's Keyword would end them.
+    _LOOKAHEAD_RE = re.compile(r'[ \t\r\n]*(?:(?P<word>[A-Za-z][0-9A-Za-z_$]*)(?P<brace>[ \t\r\n]*\{)?'
+                               r'|(?P<number>-?[0-9])|(?P<punct>\S))')
+
+    def __init__(self, alternatives):
+        super(Dispatch, self).__init__([element for element, _ in alternatives])
+        keys = set([self.WORD])
+        for _, first in alternatives:
+            keys.update(first)
+
+        self.table = {}
+        for key in keys:
+            self.table[key] = [element for element, first in alternatives if self._starts(first, key)]
+
+    def _starts(self, first, key):
+        if key in first:
+            return True
+        if key.endswith(' {') and key[:-2] in first:
+            return True
+        return key[0].isalpha() and self.WORD in first
+
+    def parseImpl(self, instring, loc, doActions=True):
+        candidates = ()
+        m = self._LOOKAHEAD_RE.match(instring, loc)
+        if m is not None:
+            word = m.group('word')
+            if word is None:
+                key = self.NUMBER if m.group('number') else m.group('punct')
+            elif m.group('brace') and word + ' {' in self.table:
+                key = word + ' {'
+            elif word in self.table:
+                key = word
+            else:
+                key = self.WORD
+            candidates = self.table.get(key, ())
+
+        max_exception = None
+        for e in candidates:
+            try:
+                return e._parse(instring, loc, doActions)
+            except ParseException as err:
+                if max_exception is None or err.loc > max_exception.loc:
+                    max_exception = err
+            except IndexError:
+                if max_exception is None or len(instring) > max_exception.loc:
+                    max_exception = ParseException(instring, len(instring), e.errmsg, self)
+
+        if max_exception is None:
+            raise ParseException(instring, loc, self.errmsg, self)
+        max_exception.msg = self.errmsg
+        raise max_exception
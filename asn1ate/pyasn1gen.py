@@ -33,6 +33,7 @@ import argparse
 import keyword
 import contextlib
 from asn1ate import parser, __version__
+from asn1ate.parsecache import ParseCache
 from asn1ate.support import pygen
 from asn1ate.sema import *
 
@@ -87,6 +88,8 @@ class Pyasn1Backend(object):
     """
 
     def __init__(self, sema_module, out_stream, referenced_modules):
+        if not isinstance(referenced_modules, ModuleSet):
+            referenced_modules = ModuleSet(referenced_modules)
         self.sema_module = sema_module
         self.referenced_modules = referenced_modules
         self.writer = pygen.PythonWriter(out_stream)
@@ -135,12 +138,13 @@ class Pyasn1Backend(object):
         self.writer.write_blanks(2)
 
         # Generate _OID if sema_module contains any object identifier values.
-        oids = [n for n in self.sema_module.descendants() if isinstance(n, ObjectIdentifierValue)]
+        oids = [n for n in self.sema_module.iter_descendants() if isinstance(n, ObjectIdentifierValue)]
         if oids:
             self.writer.write_block(self.generate_OID())
             self.writer.write_blanks(2)
 
-        assignment_components = dependency_sort(self.sema_module.assignments)
+        assignment_components = dependency_sort(self.sema_module.assignments,
+                                                self.sema_module.dependency_graph())
         for component in assignment_components:
             for assignment in component:
                 self.writer.write_block(self.generate_decl(assignment))
@@ -181,7 +185,7 @@ class Pyasn1Backend(object):
         assigned_type, type_decl = assignment.type_name, assignment.type_decl
 
         if isinstance(type_decl, SelectionType):
-            type_decl = self.sema_module.resolve_selection_type(type_decl)
+            type_decl = self.sema_module.resolve_selection_type(type_decl, self.referenced_modules)
 
         assigned_type = _translate_type(assigned_type)
         base_type = _translate_type(type_decl.type_name)
@@ -344,7 +348,7 @@ class Pyasn1Backend(object):
         return type_expr
 
     def inline_selection_type(self, t):
-        selected_type = self.sema_module.resolve_selection_type(t)
+        selected_type = self.sema_module.resolve_selection_type(t, self.referenced_modules)
         if selected_type is None:
             raise Exception('Found no member %s in %s' % (t.identifier, t.type_decl))
 
@@ -647,12 +651,16 @@ def _maybe_open(filename):
 
 # Simplistic command-line driver
 def main(args):
-    with open(args.file, 'r') as data:
-        asn1def = data.read()
-
-    parse_tree = parser.parse_asn1(asn1def)
-
-    modules = build_semantic_model(parse_tree)
+    cache = None if getattr(args, 'no_cache', False) else ParseCache()
+
+    # Build each module as soon as it's parsed, so only one module's syntax
+    # tree is alive at a time. The parser maps the file instead of reading it.
+    workers = getattr(args, 'workers', 1)
+    with open(args.file, 'rb') as data:
+        if workers != 1:
+            modules = ModuleSet(parse_semantic_model(data, workers=workers))
+        else:
+            modules = ModuleSet(build_semantic_model(parser.parse_asn1_iter(data, cache=cache)))
     if len(modules) > 1 and not args.split:
         print('WARNING: More than one module generated to the same stream.', file=sys.stderr)
 
@@ -694,7 +702,14 @@ def main_cli():
                             help='output multiple modules to separate files')
     arg_parser.add_argument('--include-asn1', action='store_true',
                             help='output ASN.1 source as part of generated code')
+    arg_parser.add_argument('--no-cache', action='store_true',
+                            help='always parse, bypassing the parse tree cache in $ASN1ATE_CACHE_DIR '
+                                 '(default: ~/.cache/asn1ate)')
+    arg_parser.add_argument('--workers', type=int, default=1,
+                            help='parse and build modules in parallel in this many processes, '
+                                 '0 for one per CPU, without the parse tree cache (default: 1)')
     args = arg_parser.parse_args()
+    args.workers = args.workers or None
     return main(args)
 
 
@@ -0,0 +1,739 @@
+# Copyright (c) 2013-2019, Schneider Electric Buildings AB
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Schneider Electric Buildings AB nor the
+#       names of contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+""" A hand-written recursive-descent parser for ASN.1.
+
+This is an alternative to the pyparsing grammar in ``asn1ate.parser``. It
+splits the source into a flat token stream up front and then parses the token
+stream predictively, choosing alternatives based on the next token.
+
+It produces exactly the same tree of AnnotatedToken objects as the pyparsing
+grammar, so the two can be used interchangeably with ``asn1ate.sema``. To keep
+it that way, the productions below are kept in the same order and shape as
+``_build_asn1_grammar``, and where the pyparsing grammar relies on ordered
+choice, alternatives are tried in the same order.
+
+Use it through ``asn1ate.parser.parse_asn1(..., backend='rd')``.
+"""
+
+import re
+from pyparsing import ParseException
+from asn1ate import lexer
+from asn1ate.parser import AnnotatedToken
+
+__all__ = ['parse_asn1', 'parse_asn1_iter']
+
+
+def parse_asn1(asn1_definition, token_factory=AnnotatedToken):
+    """ Parse a string containing one or more ASN.1 module definitions.
+    Returns a list of module syntax trees represented as nested lists of
+    AnnotatedToken objects, or whatever token_factory builds, see
+    asn1ate.parser.parse_asn1.
+    """
+    return list(parse_asn1_iter(asn1_definition, token_factory))
+
+
+def parse_asn1_iter(asn1_definition, token_factory=AnnotatedToken):
+    """ Like parse_asn1, but a generator yielding each module's syntax tree as
+    soon as the module has been parsed.
+    """
+    stripped, _ = lexer.strip_comments(asn1_definition)
+
+    parser = _Parser(asn1_definition, lexer.tokenize(stripped), token_factory)
+    return parser.iter_modules()
+
+
+_SIGNED_NUMBER_RE = re.compile(lexer.SIGNED_NUMBER + '$')
+_CONSTRAINT_REAL_RE = re.compile(lexer.CONSTRAINT_REAL_NUMBER + '$')
+
+
+class _Mismatch(Exception):
+    """ Raised internally when a production does not match. """
+    pass
+
+
+class _Parser(object):
+    def __init__(self, source, tokens, token_factory=AnnotatedToken):
+        self.source = source
+        self.tokens = tokens
+        self.token_factory = token_factory
+        self.pos = 0
+
+        # Furthest failure seen, for error reporting.
+        self.error_pos = 0
+        self.error_expected = None
+
+    def iter_modules(self):
+        """ OneOrMore(module_definition): the first module must parse, parsing
+        stops silently at the first module after that which doesn't.
+        """
+        try:
+            yield self.module_definition()
+        except _Mismatch:
+            token = self.tokens[self.error_pos]
+            raise ParseException(self.source, token.start, 'Expected %s' % self.error_expected)
+
+        while self.peek().kind != 'eof':
+            module = self.attempt(self.module_definition)
+            if module is None:
+                break
+            yield module
+
+    # Token stream helpers
+
+    def peek(self, offset=0):
+        index = min(self.pos + offset, len(self.tokens) - 1)
+        return self.tokens[index]
+
+    def fail(self, expected):
+        if self.pos >= self.error_pos:
+            self.error_pos = self.pos
+            self.error_expected = expected
+        raise _Mismatch()
+
+    def attempt(self, production, *args):
+        """ Run production and return its result, or restore the position
+        and return None if it did not match.
+        """
+        saved = self.pos
+        try:
+            return production(*args)
+        except _Mismatch:
+            self.pos = saved
+            return None
+
+    def at(self, punct, offset=0):
+        token = self.peek(offset)
+        return token.kind == 'punct' and token.value == punct
+
+    def at_word(self, offset=0):
+        return self.peek(offset).kind == 'word'
+
+    def at_upper(self, offset=0):
+        token = self.peek(offset)
+        return token.kind == 'word' and 'A' <= token.value[0] <= 'Z'
+
+    def at_lower(self, offset=0):
+        token = self.peek(offset)
+        return token.kind == 'word' and 'a' <= token.value[0] <= 'z'
+
+    def at_keyword(self, keyword, offset=0):
+        token = self.peek(offset)
+        return token.value == keyword and token.kind in ('word', 'keyword')
+
+    def at_unsigned_number(self, offset=0):
+        token = self.peek(offset)
+        return token.kind == 'number' and token.value.isdigit()
+
+    def expect(self, punct):
+        if not self.at(punct):
+            self.fail(repr(punct))
+        self.pos += 1
+
+    def keyword(self, keyword):
+        if not self.at_keyword(keyword):
+            self.fail(repr(keyword))
+        self.pos += 1
+        return keyword
+
+    def optional_keyword(self, *keywords):
+        for keyword in keywords:
+            if self.at_keyword(keyword):
+                return self.keyword(keyword)
+        return None
+
+    def word(self):
+        if not self.at_word():
+            self.fail('identifier')
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token.value
+
+    def upper(self):
+        if not self.at_upper():
+            self.fail('type reference')
+        return self.word()
+
+    def lower(self):
+        if not self.at_lower():
+            self.fail('identifier')
+        return self.word()
+
+    def unsigned_number(self):
+        if not self.at_unsigned_number():
+            self.fail('number')
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token.value
+
+    def signed_number(self):
+        token = self.peek()
+        if token.kind != 'number' or not _SIGNED_NUMBER_RE.match(token.value):
+            self.fail('signed number')
+        self.pos += 1
+        return token.value
+
+    def node(self, token_type, elements, start):
+        """ An AnnotatedToken spanning the tokens from index start up to the
+        current position.
+        """
+        first = self.tokens[start]
+        end = self.tokens[self.pos - 1].end if self.pos > start else first.start
+        return self.token_factory(token_type, elements, first.start, end)
+
+    def delimited_list(self, production, delim, elements):
+        elements.append(production())
+        while self.at(delim):
+            saved = self.pos
+            self.pos += 1
+            element = self.attempt(production)
+            if element is None:
+                self.pos = saved
+                break
+            elements.append(element)
+        return elements
+
+    def braced_list(self, production):
+        self.expect('{')
+        elements = []
+        if not self.at('}'):
+            self.attempt(self.delimited_list, production, ',', elements)
+        self.expect('}')
+        return elements
+
+    def first_of(self, alternatives):
+        """ Ordered choice between the given productions. """
+        for production in alternatives:
+            result = self.attempt(production)
+            if result is not None:
+                return result
+        self.fail('one of %s' % ', '.join(p.__name__ for p in alternatives))
+
+    # Modules
+
+    def module_definition(self):
+        start = self.pos
+        module_reference = self.module_reference()
+        definitive_identifier = self.definitive_identifier()
+        self.keyword('DEFINITIONS')
+        tag_default = self.optional_keyword('EXPLICIT TAGS', 'IMPLICIT TAGS', 'AUTOMATIC TAGS')
+        extension_default = self.optional_keyword('EXTENSIBILITY IMPLIED')
+        self.expect('::=')
+        self.keyword('BEGIN')
+        module_body = self.module_body()
+        self.keyword('END')
+        return self.node('ModuleDefinition',
+                         [module_reference, definitive_identifier, tag_default,
+                          extension_default, module_body], start)
+
+    def module_reference(self):
+        start = self.pos
+        return self.node('ModuleReference', [self.upper()], start)
+
+    def definitive_identifier(self):
+        start = self.pos
+        elements = []
+        if self.at('{'):
+            elements = self.attempt(self.definitive_objid_component_list) or []
+        return self.node('DefinitiveIdentifier', elements, start)
+
+    def definitive_objid_component_list(self):
+        self.expect('{')
+        components = [self.definitive_objid_component()]
+        while not self.at('}'):
+            component = self.attempt(self.definitive_objid_component)
+            if component is None:
+                break
+            components.append(component)
+        self.expect('}')
+        return components
+
+    def definitive_objid_component(self):
+        start = self.pos
+        if self.at_lower():
+            name_form = self.name_form()
+            if self.at('(') and self.at_unsigned_number(1) and self.at(')', 2):
+                self.pos += 1
+                number_form = self.definitive_number_form()
+                self.pos += 1
+                return self.node('DefinitiveNameAndNumberForm', [name_form, number_form], start)
+            return name_form
+        return self.definitive_number_form()
+
+    def definitive_number_form(self):
+        start = self.pos
+        return self.node('DefinitiveNumberForm', [self.unsigned_number()], start)
+
+    def module_body(self):
+        start = self.pos
+        exports = None
+        if self.at_keyword('EXPORTS'):
+            exports = self.attempt(self.exports)
+        imports = None
+        if self.at_keyword('IMPORTS'):
+            imports = self.attempt(self.imports)
+        return self.node('ModuleBody', [exports, imports, self.assignment_list()], start)
+
+    def symbol_list(self):
+        return self.delimited_list(self.word, ',', [])
+
+    def exports(self):
+        start = self.pos
+        self.keyword('EXPORTS')
+        symbols = []
+        if self.at_word():
+            symbols = self.symbol_list()
+        self.expect(';')
+        return self.node('Exports', symbols, start)
+
+    def imports(self):
+        start = self.pos
+        self.keyword('IMPORTS')
+        symbols_imported = []
+        while self.at_word():
+            symbols_from_module = self.attempt(self.symbols_from_module)
+            if symbols_from_module is None:
+                break
+            symbols_imported.append(symbols_from_module)
+        self.expect(';')
+        return self.node('Imports', symbols_imported, start)
+
+    def symbols_from_module(self):
+        symbols = self.symbol_list()
+        self.keyword('FROM')
+        return [symbols, self.global_module_reference()]
+
+    def global_module_reference(self):
+        start = self.pos
+        module_reference = self.module_reference()
+        oid = None
+        if self.at('{'):
+            oid = self.attempt(self.object_identifier_value)
+        return self.node('GlobalModuleReference', [module_reference, oid], start)
+
+    # Assignments
+
+    def assignment_list(self):
+        start = self.pos
+        assignments = []
+        while self.at_word():
+            assignment = self.attempt(self.assignment)
+            if assignment is None:
+                break
+            assignments.append(assignment)
+        return self.node('AssignmentList', assignments, start)
+
+    def assignment(self):
+        if self.at_upper() and self.at('::=', 1):
+            return self.type_assignment()
+        return self.value_assignment()
+
+    def type_assignment(self):
+        start = self.pos
+        type_name = self.upper()
+        self.expect('::=')
+        return self.node('TypeAssignment', [type_name, '::=', self.type_()], start)
+
+    def value_assignment(self):
+        start = self.pos
+        value_name = self.lower()
+        type_decl = self.type_()
+        self.expect('::=')
+        return self.node('ValueAssignment', [value_name, type_decl, '::=', self.value()], start)
+
+    # Types
+
+    def type_(self):
+        start = self.pos
+        alternatives = self.type_alternatives()
+        if not alternatives:
+            self.fail('type')
+        return self.node('Type', [self.first_of(alternatives)], start)
+
+    def type_alternatives(self):
+        """ The alternatives of the pyparsing type_ production that can
+        start with the next token, in the order they appear there.
+        """
+        token = self.peek()
+        if token.kind == 'punct':
+            if token.value == '[':
+                return [self.tagged_type]
+            return []
+        if token.kind == 'keyword':
+            return [getattr(self, a) for a in _TYPE_KEYWORD_ALTERNATIVES.get(token.value, ())]
+        if token.kind != 'word':
+            return []
+
+        alternatives = list(_TYPE_KEYWORD_ALTERNATIVES.get(token.value, ()))
+        if token.value in ('SEQUENCE', 'SET', 'INTEGER') and not self.at('{', 1):
+            alternatives = alternatives[1:]
+
+        if 'A' <= token.value[0] <= 'Z':
+            alternatives.append('defined_type')
+        else:
+            alternatives.append('selection_type')
+
+        return [getattr(self, a) for a in alternatives]
+
+    def tagged_type(self):
+        start = self.pos
+        tag = self.tag()
+        implicitness = self.optional_keyword('IMPLICIT', 'EXPLICIT')
+        return self.node('TaggedType', [tag, implicitness, self.type_()], start)
+
+    def tag(self):
+        start = self.pos
+        self.expect('[')
+        elements = []
+        for class_ in ('UNIVERSAL', 'APPLICATION', 'PRIVATE'):
+            if self.at_keyword(class_):
+                class_start = self.pos
+                elements.append(self.node('TagClass', [self.keyword(class_)], class_start))
+                break
+        class_number_start = self.pos
+        elements.append(self.node('TagClassNumber', [self.unsigned_number()], class_number_start))
+        self.expect(']')
+        return self.node('Tag', elements, start)
+
+    def simple_type(self):
+        start = self.pos
+        token = self.peek()
+        if self.at_keyword('ANY'):
+            elements = [self.keyword('ANY')]
+            if self.at_keyword('DEFINED BY') and self.at_lower(1):
+                self.pos += 2
+        elif token.value in _SIMPLE_TYPE_KEYWORDS and token.kind in ('word', 'keyword'):
+            elements = [self.keyword(token.value)]
+        else:
+            self.fail('type')
+
+        if elements[0] in _SIZED_SIMPLE_TYPE_KEYWORDS:
+            self.optional_size_constraint(elements)
+
+        if self.at('('):
+            constraint = self.attempt(self.value_range_constraint) or \
+                         self.attempt(self.single_value_constraint)
+            if constraint is not None:
+                elements.append(constraint)
+
+        return self.node('SimpleType', elements, start)
+
+    def restricted_integer_type(self):
+        start = self.pos
+        type_name = self.keyword('INTEGER')
+        named_numbers = self.braced_list(self.named_number)
+        constraint = None
+        if self.at('('):
+            constraint = self.attempt(self.single_value_constraint)
+        return self.node('ValueListType', [type_name, named_numbers, constraint], start)
+
+    def enumerated_type(self):
+        start = self.pos
+        type_name = self.keyword('ENUMERATED')
+        enumerations = self.braced_list(self.enumeration_or_extension_marker)
+        return self.node('ValueListType', [type_name, enumerations], start)
+
+    def bitstring_type(self):
+        start = self.pos
+        type_name = self.keyword('BIT STRING')
+        named_bits = []
+        if self.at('{'):
+            named_bits = self.attempt(self.braced_list, self.named_number)
+            if named_bits is None:
+                named_bits = []
+        constraint = None
+        if self.at('('):
+            constraint = self.attempt(self.single_value_constraint)
+        if constraint is None and (self.at('(') or self.at_keyword('SIZE')):
+            constraint = self.attempt(self.size_constraint)
+        return self.node('BitStringType', [type_name, named_bits, constraint], start)
+
+    def choice_type(self):
+        start = self.pos
+        type_name = self.keyword('CHOICE')
+        return self.node('ChoiceType', [type_name, self.braced_list(self.named_type_or_extension_marker)], start)
+
+    def sequence_type(self):
+        start = self.pos
+        type_name = self.keyword('SEQUENCE')
+        return self.node('SequenceType',
+                         [type_name, self.braced_list(self.component_type_or_extension_marker)], start)
+
+    def set_type(self):
+        start = self.pos
+        type_name = self.keyword('SET')
+        return self.node('SetType', [type_name, self.braced_list(self.component_type_or_extension_marker)], start)
+
+    def sequenceof_type(self):
+        start = self.pos
+        self.keyword('SEQUENCE')
+        return self.node('SequenceOfType', self.collection_type_elements(), start)
+
+    def setof_type(self):
+        start = self.pos
+        self.keyword('SET')
+        return self.node('SetOfType', self.collection_type_elements(), start)
+
+    def collection_type_elements(self):
+        size_constraint = None
+        if self.at('(') or self.at_keyword('SIZE'):
+            size_constraint = self.attempt(self.size_constraint)
+        self.keyword('OF')
+        return [size_constraint, self.first_of([self.type_, self.named_type])]
+
+    def defined_type(self):
+        start = self.pos
+        module_reference = None
+        if self.at('.', 1):
+            module_reference = self.module_reference()
+            self.pos += 1
+        type_name = self.upper()
+        size_constraint = None
+        if self.at('(') or self.at_keyword('SIZE'):
+            size_constraint = self.attempt(self.size_constraint)
+        return self.node('DefinedType', [module_reference, type_name, size_constraint], start)
+
+    def selection_type(self):
+        start = self.pos
+        identifier = self.identifier()
+        self.expect('<')
+        return self.node('SelectionType', [identifier, self.type_()], start)
+
+    def named_type(self):
+        start = self.pos
+        identifier = self.identifier()
+        return self.node('NamedType', [identifier, self.type_()], start)
+
+    def named_type_or_extension_marker(self):
+        if self.at('...'):
+            return self.extension_marker()
+        return self.named_type()
+
+    def component_type_or_extension_marker(self):
+        if self.at('...'):
+            return self.extension_marker()
+        return self.component_type()
+
+    def component_type(self):
+        start = self.pos
+        if self.at_keyword('COMPONENTS OF'):
+            self.keyword('COMPONENTS OF')
+            inner = self.node('ComponentTypeComponentsOf', [self.type_()], start)
+        else:
+            named_type = self.named_type()
+            if self.at_keyword('OPTIONAL'):
+                self.keyword('OPTIONAL')
+                inner = self.node('ComponentTypeOptional', [named_type], start)
+            elif self.at_keyword('DEFAULT'):
+                saved = self.pos
+                self.keyword('DEFAULT')
+                value = self.attempt(self.value)
+                if value is None:
+                    self.pos = saved
+                    inner = named_type
+                else:
+                    inner = self.node('ComponentTypeDefault', [named_type, value], start)
+            else:
+                inner = named_type
+        return self.node('ComponentType', [inner], start)
+
+    def extension_marker(self):
+        start = self.pos
+        self.expect('...')
+        return self.node('ExtensionMarker', ['...'], start)
+
+    def identifier(self):
+        start = self.pos
+        return self.node('Identifier', [self.lower()], start)
+
+    def named_number(self):
+        start = self.pos
+        identifier = self.identifier()
+        value_start = self.pos
+        self.expect('(')
+        number = self.signed_number()
+        self.expect(')')
+        value = self.node('Value', [number], value_start)
+        return self.node('NamedValue', [identifier, value], start)
+
+    def enumeration_or_extension_marker(self):
+        start = self.pos
+        if self.at('...'):
+            return self.extension_marker()
+        if self.at('(', 1):
+            named_number = self.attempt(self.named_number)
+            if named_number is not None:
+                return named_number
+        return self.node('NamedValue', [self.lower()], start)
+
+    # Constraints
+
+    def single_value_constraint(self):
+        start = self.pos
+        self.expect('(')
+        values = self.delimited_list(self.value, '|', [])
+        self.expect(')')
+        return self.node('SingleValueConstraint', [values], start)
+
+    def value_range_constraint(self):
+        start = self.pos
+        self.expect('(')
+        lower_bound = self.bound('MIN')
+        self.expect('..')
+        upper_bound = self.bound('MAX')
+        self.expect(')')
+        return self.node('ValueRangeConstraint', [lower_bound, upper_bound], start)
+
+    def bound(self, limit):
+        token = self.peek()
+        if token.kind == 'number':
+            if not _CONSTRAINT_REAL_RE.match(token.value):
+                self.fail('number')
+            self.pos += 1
+            return token.value
+        if self.at_keyword(limit) and not self.at('.', 1):
+            return self.keyword(limit)
+        return self.referenced_value()
+
+    def size_constraint(self):
+        start = self.pos
+        if self.at('('):
+            self.pos += 1
+        self.keyword('SIZE')
+        constraint = self.first_of([self.single_value_constraint, self.value_range_constraint])
+        if self.at(')'):
+            self.pos += 1
+        return self.node('SizeConstraint', [constraint], start)
+
+    def optional_size_constraint(self, elements):
+        if self.at('(') or self.at_keyword('SIZE'):
+            size_constraint = self.attempt(self.size_constraint)
+            if size_constraint is not None:
+                elements.append(size_constraint)
+
+    # Values
+
+    def value(self):
+        token = self.peek()
+        kind = token.kind
+        if kind == 'number':
+            self.pos += 1
+            return token.value
+        elif kind == 'cstring':
+            self.pos += 1
+            return token.value
+        elif kind == 'bstring':
+            self.pos += 1
+            return self.token_factory('BinaryStringValue', [token.value], token.start, token.end)
+        elif kind == 'hstring':
+            self.pos += 1
+            return self.token_factory('HexStringValue', [token.value], token.start, token.end)
+        elif kind == 'word':
+            if token.value in ('TRUE', 'FALSE', 'NULL'):
+                return self.keyword(token.value)
+            return self.referenced_value()
+        elif self.at('{'):
+            return self.object_identifier_value()
+
+        self.fail('value')
+
+    def defined_value(self):
+        if self.at_upper():
+            module_reference = self.module_reference()
+            self.expect('.')
+            return [module_reference, self.lower()]
+        return [self.lower()]
+
+    def referenced_value(self):
+        start = self.pos
+        return self.node('ReferencedValue', self.defined_value(), start)
+
+    def object_identifier_value(self):
+        start = self.pos
+        self.expect('{')
+        components = self.objid_component([])
+        while not self.at('}'):
+            if self.attempt(self.objid_component, components) is None:
+                break
+        self.expect('}')
+        return self.node('ObjectIdentifierValue', components, start)
+
+    def objid_component(self, components):
+        start = self.pos
+        if self.at_lower():
+            name_form = self.name_form()
+            if self.at('(') and self.at_unsigned_number(1) and self.at(')', 2):
+                self.pos += 1
+                number_form = self.number_form()
+                self.pos += 1
+                components.append(self.node('NameAndNumberForm', [name_form, number_form], start))
+            else:
+                components.append(name_form)
+        elif self.at_unsigned_number():
+            components.append(self.number_form())
+        else:
+            components.extend(self.defined_value())
+        return components
+
+    def number_form(self):
+        start = self.pos
+        return self.node('NumberForm', [self.unsigned_number()], start)
+
+    def name_form(self):
+        start = self.pos
+        return self.node('NameForm', [self.lower()], start)
+
+
+# Built-in type alternatives of the type_ production, by leading keyword, in
+# grammar order. _Parser.type_alternatives drops the first SEQUENCE, SET and
+# INTEGER alternative when it needs a '{' that isn't there.
+_TYPE_KEYWORD_ALTERNATIVES = {
+    'INTEGER': ('restricted_integer_type', 'simple_type'),
+    'ENUMERATED': ('enumerated_type',),
+    'CHOICE': ('choice_type',),
+    'SEQUENCE': ('sequence_type', 'sequenceof_type'),
+    'SET': ('set_type', 'setof_type'),
+    'BIT STRING': ('bitstring_type',),
+}
+
+_SIMPLE_TYPE_KEYWORDS = frozenset([
+    'ANY', 'BOOLEAN', 'NULL', 'REAL', 'INTEGER',
+    'OCTET STRING', 'CHARACTER STRING', 'OBJECT IDENTIFIER',
+    'BMPString', 'GeneralString', 'GraphicString', 'IA5String', 'ISO646String',
+    'NumericString', 'PrintableString', 'TeletexString', 'T61String',
+    'UniversalString', 'UTF8String', 'VideotexString', 'VisibleString',
+    'GeneralizedTime', 'UTCTime', 'ObjectDescriptor',
+])
+
+# Simple types that take an optional size constraint directly.
+_SIZED_SIMPLE_TYPE_KEYWORDS = frozenset([
+    'OCTET STRING', 'CHARACTER STRING',
+    'BMPString', 'GeneralString', 'GraphicString', 'IA5String', 'ISO646String',
+    'NumericString', 'PrintableString', 'TeletexString', 'T61String',
+    'UniversalString', 'UTF8String', 'VideotexString', 'VisibleString',
+])
+
+for _keyword in _SIMPLE_TYPE_KEYWORDS:
+    _TYPE_KEYWORD_ALTERNATIVES.setdefault(_keyword, ('simple_type',))
@@ -23,31 +23,280 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import pickle
+import threading
 from asn1ate import parser
 
 
 def build_semantic_model(parse_result):
     """ Build a semantic model of the ASN.1 definition
     from a syntax tree generated by asn1ate.parser.
+    parse_result may also be the generator returned by
+    parser.parse_asn1_iter, in which case each module is
+    built as soon as it's been parsed.
+
+    Assignments are built when first accessed, so with a
+    lazy parse, only the assignments that are used (and
+    those they depend on) are ever parsed.
     """
     root = []
     for token in parse_result:
         _assert_annotated_token(token)
         root.append(_create_sema_node(token))
 
-    # Head back through the model to act on any automatic tagging
-    # Objects in root must be Modules by definition of the parser
-    for module in root:
-        if module.tag_default == TagImplicitness.AUTOMATIC:
-            # Automatic tagging is on - wrap the members of constructed types
-            for descendant in module.descendants():
-                if isinstance(descendant, ConstructedType):
-                    descendant.auto_tag()
-
     return root
 
 
-def topological_sort(assignments):
+def parse_semantic_model(asn1_definition, workers=1, **parse_options):
+    """ Parse an ASN.1 definition straight into a semantic
+    model, without building a syntax tree first: the parser
+    creates sema nodes as it goes. Returns the same list of
+    Modules as
+      build_semantic_model(parser.parse_asn1(asn1_definition))
+    parse_options are passed on to parser.parse_asn1.
+
+    If workers is not 1, the source is split at module
+    boundaries and each module is parsed and built, with
+    all its assignments and its dependency graph, by a pool
+    of that many processes (None for one per CPU). Modules
+    are sent back pickled; lookups across modules are left
+    to a ModuleSet in this process.
+    """
+    if workers != 1:
+        return _parse_parallel(asn1_definition, workers, parse_options)
+
+    outer_tag_default = getattr(_construction_state, 'tag_default', None)
+    outer_constructed = getattr(_construction_state, 'constructed', None)
+    # The tag default is only known once the whole module is parsed, so
+    # constructed types are tagged then, see _build_sema_node.
+    _construction_state.tag_default = None
+    _construction_state.constructed = []
+    try:
+        return parser.parse_asn1(asn1_definition, token_factory=_build_sema_node, **parse_options)
+    finally:
+        _construction_state.tag_default = outer_tag_default
+        _construction_state.constructed = outer_constructed
+
+
+def _parse_parallel(asn1_definition, workers, parse_options):
+    asn1_definition, texts = parser.split_modules(asn1_definition, parse_options.pop('encoding', 'utf-8'))
+    if len(texts) < 2:
+        return parse_semantic_model(asn1_definition, **parse_options)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    modules = []
+    with ProcessPoolExecutor(workers) as executor:
+        results = executor.map(_parse_module, texts, [parse_options] * len(texts))
+        for i, result in enumerate(results):
+            if result is None:
+                if i == 0:
+                    # Parse in-process to raise the error against the full
+                    # source.
+                    return parse_semantic_model(asn1_definition, **parse_options)
+                # Like the parser, stop at the first module that doesn't parse.
+                break
+            modules.extend(pickle.loads(result))
+
+    return modules
+
+
+def _parse_module(text, parse_options):
+    """ Parse and build one module in a worker process. Returns the
+    pickled list of Modules, or None if the text doesn't parse.
+    """
+    try:
+        modules = parse_semantic_model(text, **parse_options)
+    except parser.ParseException:
+        return None
+
+    for module in modules:
+        module.dependency_graph()
+        # All assignments are built, the syntax tree isn't needed anymore.
+        module._assignment_tokens = module.assignments
+    return pickle.dumps(modules, pickle.HIGHEST_PROTOCOL)
+
+
+class ModuleSet(object):
+    """ A set of modules that may refer to each other, indexed by
+    module name, e.g. all modules built from one specification.
+
+    Iterating yields the modules in the order they were added, so a
+    ModuleSet can be passed wherever a list of referenced modules is
+    expected. Resolved type references are cached per set, so share one
+    ModuleSet between everything that resolves types across the same
+    modules. A cached reference is dropped once the assignments of a
+    module it was resolved through are replaced.
+    """
+    def __init__(self, modules=()):
+        self._modules = []
+        self._modules_by_name = {}
+        # (module name, type name) -> (resolved type declaration, the
+        # (module, assignments version) pairs it was resolved through)
+        self._resolved = {}
+        self._resolving = set()
+        # (module name, reference name) -> assignments in other modules using it
+        self._external_dependents = None
+        for module in modules:
+            self.add(module)
+
+    def add(self, module):
+        self._modules.append(module)
+        self._modules_by_name.setdefault(module.name, module)
+        self._resolved.clear()
+        self._external_dependents = None
+
+    def find(self, module_name):
+        """ Return the module called module_name. """
+        try:
+            return self._modules_by_name[module_name]
+        except KeyError:
+            raise Exception('Unrecognized referenced module %s in %s.' % (module_name,
+                                                                          [module.name for module in
+                                                                           self._modules]))
+
+    def resolve_type_decl(self, module, type_decl):
+        """ Resolve type_decl, as seen from module, through any chain of
+        user-defined type references to its built-in declaration.
+
+        Raises an exception if the reference chain loops.
+        """
+        chain = []
+        versions = []
+        try:
+            while True:
+                if isinstance(type_decl, SelectionType):
+                    type_decl = module.resolve_selection_type(type_decl, self)
+                elif isinstance(type_decl, DefinedType):
+                    if type_decl.module_ref:
+                        module = module._find_module(type_decl.module_ref.name, self)
+                    key = (module.name, type_decl.type_name)
+                    cached = self._resolved.get(key)
+                    if cached is not None and all(m._version == version for m, version in cached[1]):
+                        type_decl = cached[0]
+                        versions.extend(cached[1])
+                        break
+                    if key in self._resolving:
+                        raise Exception('Circular type reference to %s.%s' % key)
+                    self._resolving.add(key)
+                    chain.append(key)
+                    versions.append((module, module._version))
+                    type_decl, module = module._lookup_type(type_decl.type_name, self)
+                    versions.append((module, module._version))
+                else:
+                    break
+        finally:
+            self._resolving.difference_update(chain)
+
+        versions = tuple(versions)
+        for key in chain:
+            self._resolved[key] = (type_decl, versions)
+        return type_decl
+
+    def __iter__(self):
+        return iter(self._modules)
+
+    def __len__(self):
+        return len(self._modules)
+
+    def __contains__(self, module_name):
+        return module_name in self._modules_by_name
+
+    def __getitem__(self, module_name):
+        return self._modules_by_name[module_name]
+
+    def dependents(self, module_name, reference_name):
+        """ Return the assignments in all modules of the set that use
+        reference_name of module_name directly, as a set of (module name,
+        reference name) pairs.
+        """
+        if self._external_dependents is None:
+            self._external_dependents = {}
+            for module in self._modules:
+                graph = module.dependency_graph()
+                for name, external in graph.external_references.items():
+                    for target in external:
+                        self._external_dependents.setdefault(target, set()).add((module.name, name))
+
+        dependents = set(self._external_dependents.get((module_name, reference_name), ()))
+        if module_name in self:
+            local_dependents = self[module_name].dependency_graph().referenced_by.get(reference_name, ())
+            dependents.update((module_name, name) for name in local_dependents)
+        return dependents
+
+
+def _as_module_set(modules):
+    """ Return modules as a ModuleSet, wrapping anything else in a new one.
+    """
+    if isinstance(modules, ModuleSet):
+        return modules
+    return ModuleSet(modules)
+
+
+class DependencyGraph(object):
+    """ The dependencies between the assignments of a module, built in one
+    walk over the assignments:
+
+    - ``references`` maps each assignment's reference name to the names
+      of the assignments in the same module it uses
+    - ``referenced_by`` is the reverse, mapping each assignment's
+      reference name to the names of the assignments that use it
+    - ``external_references`` maps each assignment's reference name to
+      the (module name, reference name) pairs it uses from other modules,
+      through imports or module-qualified references
+
+    Get it through ``Module.dependency_graph``.
+    """
+    def __init__(self, module):
+        self.module_name = module.name
+        self.references = {}
+        self.referenced_by = {}
+        self.external_references = {}
+
+        for assignment in module.assignments:
+            name = assignment.reference_name()
+            references = set()
+            external_references = set()
+            for node in assignment.iter_descendants():
+                if not hasattr(node, 'reference_name'):
+                    continue
+
+                reference_name = node.reference_name()
+                module_ref = getattr(node, 'module_ref', None)
+                if module_ref and module_ref.name != module.name:
+                    external_references.add((module_ref.name, reference_name))
+                    continue
+
+                module_name, i = module._symbols.get(reference_name, (None, None))
+                if i is not None:
+                    references.add(reference_name)
+                elif module_name is not None:
+                    external_references.add((module_name, reference_name))
+
+            self.references[name] = references
+            self.external_references[name] = external_references
+            self.referenced_by.setdefault(name, set())
+            for reference_name in references:
+                self.referenced_by.setdefault(reference_name, set()).add(name)
+
+    def affected(self, reference_names):
+        """ Return the names of all assignments in the module that depend on
+        any of reference_names, directly or indirectly, including
+        reference_names themselves.
+        """
+        affected = set()
+        pending = list(reference_names)
+        while pending:
+            name = pending.pop()
+            if name in affected:
+                continue
+            affected.add(name)
+            pending.extend(self.referenced_by.get(name, ()))
+
+        return affected
+
+
+def topological_sort(assignments, dependency_graph=None):
     """ Algorithm adapted from:
     http://en.wikipedia.org/wiki/Topological_sorting.
 
@@ -58,20 +307,28 @@ def topological_sort(assignments):
     - reference_name() -- returns the reference name of the assignment
     - references() -- returns an iterable of reference names
     upon which the assignment depends.
-    """
-    graph = dict((a.reference_name(), a.references()) for a in assignments)
 
-    def has_predecessor(node):
-        for predecessors in graph.values():
-            if node in predecessors:
-                return True
+    If the assignments are from a single module, pass its
+    ``dependency_graph()`` as dependency_graph to use the dependencies
+    recorded there instead of calling ``references()``.
+    """
+    if dependency_graph is not None:
+        graph = dict((a.reference_name(), dependency_graph.references[a.reference_name()])
+                     for a in assignments)
+    else:
+        graph = dict((a.reference_name(), a.references()) for a in assignments)
 
-        return False
+    # Count the predecessors of every node, i.e. the number of
+    # assignments that reference it (Kahn's algorithm).
+    predecessor_counts = {}
+    for successors in graph.values():
+        for successor in successors:
+            predecessor_counts[successor] = predecessor_counts.get(successor, 0) + 1
 
-    # Build a topological order of reference names
-    topological_order = []
+    # Build a topological order of reference names, last first
+    reverse_order = []
     roots = [name for name in graph.keys()
-             if not has_predecessor(name)]
+             if not predecessor_counts.get(name)]
 
     while roots:
         root = roots.pop()
@@ -79,21 +336,23 @@ def topological_sort(assignments):
         # Remove the current node from the graph
         # and collect all new roots (the nodes that
         # were previously only referenced from n)
-        successors = graph.pop(root, set())
-        roots.extend(successor for successor in successors
-                     if not has_predecessor(successor))
+        successors = graph.pop(root, ())
+        for successor in successors:
+            predecessor_counts[successor] -= 1
+            if not predecessor_counts[successor]:
+                roots.append(successor)
 
-        topological_order.insert(0, root)
+        reverse_order.append(root)
 
     if graph:
         raise Exception('Can\'t sort cyclic references: %s' % graph)
 
     # Sort the actual assignments based on the topological order
-    return sorted(assignments,
-                  key=lambda a: topological_order.index(a.reference_name()))
+    position = dict((name, i) for i, name in enumerate(reversed(reverse_order)))
+    return sorted(assignments, key=lambda a: position[a.reference_name()])
 
 
-def dependency_sort(assignments):
+def dependency_sort(assignments, dependency_graph=None):
     """ We define a dependency sort as a Tarjan strongly-connected
     components resolution. Tarjan's algorithm happens to topologically
     sort as a by-product of finding strongly-connected components.
@@ -113,6 +372,9 @@ def dependency_sort(assignments):
     except for the cycle components, where there is no order. They
     can be detected on the basis of their plurality and handled
     separately.
+
+    As for ``topological_sort``, dependency_graph is an optional
+    DependencyGraph of the module the assignments belong to.
     """
     # Build reverse-lookup table from name -> node.
     assignments_by_name = {a.reference_name(): a for a in assignments}
@@ -120,53 +382,74 @@ def dependency_sort(assignments):
     # Build the dependency graph.
     graph = {}
     for assignment in assignments:
-        references = sorted(assignment.references())
+        if dependency_graph is not None:
+            references = sorted(dependency_graph.references[assignment.reference_name()])
+        else:
+            references = sorted(assignment.references())
         graph[assignment] = [assignments_by_name[r] for r in references
                              if r in assignments_by_name]
 
     # Now let Tarjan do its work! Adapted from here:
     # http://www.logarithmic.net/pfh-files/blog/01208083168/tarjan.py
+    # The recursion of strongconnect is unrolled into an explicit stack of
+    # (node, successor iterator) pairs, so there is no limit on the length
+    # of reference chains.
     index_counter = [0]
     stack = []
+    on_stack = set()
     lowlinks = {}
     index = {}
     result = []
 
-    def strongconnect(node):
+    def visit(node):
         # Set the depth index for this node to the smallest unused index
         index[node] = index_counter[0]
         lowlinks[node] = index_counter[0]
         index_counter[0] += 1
         stack.append(node)
+        on_stack.add(node)
+        return node, iter(graph.get(node, []))
+
+    for root in sorted(graph.keys(), key=lambda a: a.reference_name()):
+        if root in lowlinks:
+            continue
+
+        work = [visit(root)]
+        while work:
+            node, successors = work[-1]
+
+            # Consider successors of `node`
+            for successor in successors:
+                if successor not in lowlinks:
+                    # Successor has not yet been visited; descend into it
+                    # and resume with the next successor when done.
+                    work.append(visit(successor))
+                    break
+                elif successor in on_stack:
+                    # the successor is in the stack and hence in the current
+                    # strongly connected component (SCC)
+                    lowlinks[node] = min(lowlinks[node], index[successor])
+            else:
+                # All successors are done.
+                work.pop()
 
-        # Consider successors of `node`
-        successors = graph.get(node, [])
-        for successor in successors:
-            if successor not in lowlinks:
-                # Successor has not yet been visited; recurse on it
-                strongconnect(successor)
-                lowlinks[node] = min(lowlinks[node], lowlinks[successor])
-            elif successor in stack:
-                # the successor is in the stack and hence in the current
-                # strongly connected component (SCC)
-                lowlinks[node] = min(lowlinks[node], index[successor])
-
-        # If `node` is a root node, pop the stack and generate an SCC
-        if lowlinks[node] == index[node]:
-            connected_component = []
+                # If `node` is a root node, pop the stack and generate an SCC
+                if lowlinks[node] == index[node]:
+                    connected_component = []
 
-            while True:
-                successor = stack.pop()
-                connected_component.append(successor)
-                if successor == node:
-                    break
+                    while True:
+                        successor = stack.pop()
+                        on_stack.discard(successor)
+                        connected_component.append(successor)
+                        if successor == node:
+                            break
 
-            component = tuple(connected_component)
-            result.append(component)
+                    component = tuple(connected_component)
+                    result.append(component)
 
-    for node in sorted(graph.keys(), key=lambda a: a.reference_name()):
-        if node not in lowlinks:
-            strongconnect(node)
+                if work:
+                    parent = work[-1][0]
+                    lowlinks[parent] = min(lowlinks[parent], lowlinks[node])
 
     return result
 
@@ -217,110 +500,248 @@ etc) must have a method called ``reference_name``.
 
 
 class SemaNode(object):
-    """ Base class for all sema nodes. """
+    """ Base class for all sema nodes.
+
+    Subclasses declare their member variables in ``__slots__``, and
+    the ones that can hold other sema nodes in ``_child_fields``.
+    """
+    __slots__ = ()
+    _child_fields = ()
 
     def children(self):
         """ Return a list of all contained sema nodes.
 
-        This implementation finds all member variables of type
-        SemaNode. It also expands list members, to transparently
-        handle the case where a node holds a list of other
-        sema nodes.
+        This implementation collects the members named in
+        ``_child_fields`` that are sema nodes. It also expands list
+        members, to transparently handle the case where a node holds
+        a list of other sema nodes. List members are listed after the
+        single-node members in ``_child_fields``, so the order is the
+        same for every node of a class.
         """
-        # Collect all SemaNode members.
-        members = list(vars(self).values())
-        children = [m for m in members if isinstance(m, SemaNode)]
-
-        # Expand SemaNodes out of list members, but do not recurse
-        # through lists of lists.
-        list_members = [m for m in members if isinstance(m, list)]
-        for m in list_members:
-            children.extend(n for n in m if isinstance(n, SemaNode))
+        children = []
+        for name in self._child_fields:
+            member = getattr(self, name)
+            if isinstance(member, SemaNode):
+                children.append(member)
+            elif isinstance(member, list):
+                # Do not recurse through lists of lists.
+                children.extend(n for n in member if isinstance(n, SemaNode))
 
         return children
 
     def descendants(self):
         """ Return a list of all recursively contained sema nodes.
         """
-        descendants = []
-        for child in self.children():
-            descendants.append(child)
-            descendants.extend(child.descendants())
+        return list(self.iter_descendants())
 
-        return descendants
+    def iter_descendants(self):
+        """ Generate all recursively contained sema nodes, depth-first in
+        the same order as ``descendants``.
+
+        Uses an explicit stack rather than recursion, so there is no
+        limit on nesting depth and no list of all descendants is built.
+        The walk takes about as long as building that list, but peak
+        memory stays proportional to the depth of the tree.
+        """
+        stack = self.children()
+        stack.reverse()
+        while stack:
+            node = stack.pop()
+            yield node
+            children = node.children()
+            if children:
+                # children() returns a new list, so it's ours to reverse.
+                children.reverse()
+                stack.extend(children)
 
 
 class Module(SemaNode):
+    """ Assignments are built from their tokens on first access, either all
+    of them through ``assignments`` or one by one through
+    ``get_assignment``.
+
+    Every module has a symbol table, mapping the reference names of its
+    assignments and the symbols it imports to the module they are defined
+    in. ``lookup`` and the type resolution methods go through it.
+    """
+
+    __slots__ = ('name', 'tag_default', 'exports', 'imports', '_assignment_tokens', '_assignments',
+                 '_assignment_index', '_symbols', '_user_types', '_dependency_graph', '_version')
+
     def __init__(self, elements):
-        self._user_types = {}
+        # Bumped whenever the assignments are replaced, see ModuleSet.
+        self._version = 0
+        self._user_types = None
+        self._dependency_graph = None
 
         module_reference, definitive_identifier, tag_default, extension_default, module_body = elements
 
-        self.name = module_reference.elements[0]
-
-        if tag_default == 'IMPLICIT TAGS':
-            self.tag_default = TagImplicitness.IMPLICIT
-        elif tag_default == 'EXPLICIT TAGS':
-            self.tag_default = TagImplicitness.EXPLICIT
-        elif tag_default == 'AUTOMATIC TAGS':
-            self.tag_default = TagImplicitness.AUTOMATIC
-        else:
-            if tag_default is not None:
-                raise Exception('Unexpected tag default: %s' % tag_default)
-            # Tag default was not specified, default to explicit
-            self.tag_default = TagImplicitness.EXPLICIT
+        self.name = _create_sema_node(module_reference).name
+        self.tag_default = _tag_implicitness(tag_default)
 
         exports, imports, assignments = module_body.elements
         self.exports = _maybe_create_sema_node(exports)
         self.imports = _maybe_create_sema_node(imports)
-        self.assignments = [_create_sema_node(token) for token in assignments.elements]
+        self._index_assignments(assignments.elements, [None] * len(assignments.elements))
+
+    def _index_assignments(self, tokens, assignments):
+        self._assignment_tokens = tokens
+        self._assignments = assignments
+        self._assignment_index = dict((_assignment_name(token), i)
+                                      for i, token in enumerate(self._assignment_tokens))
+
+        # Symbol table: reference name -> (defining module name, assignment
+        # index), where the index is None for imported symbols. Local
+        # assignments take precedence over imports.
+        self._symbols = {}
+        if isinstance(self.imports, Imports):
+            for module_reference, symbols in self.imports.imports.items():
+                for symbol in symbols:
+                    self._symbols[symbol] = (module_reference.name, None)
+        for reference_name, i in self._assignment_index.items():
+            self._symbols[reference_name] = (self.name, i)
+
+    @property
+    def assignments(self):
+        """ The list of all assignments, built on first access. It's the
+        same list every time, but lookups only know the assignments the
+        module was built with or last assigned, so assign the list back
+        after changing it in place.
+        """
+        for i in range(len(self._assignments)):
+            self._build_assignment(i)
+        return self._assignments
+
+    @assignments.setter
+    def assignments(self, assignments):
+        self._index_assignments(assignments, assignments)
+        self._version += 1
+        self._user_types = None
+        self._dependency_graph = None
+
+    def assignment_names(self):
+        """ Return the reference names of all assignments, without building
+        them.
+        """
+        return [_assignment_name(token) for token in self._assignment_tokens]
+
+    def get_assignment(self, reference_name):
+        """ Return the assignment of reference_name, building only that one.
+        Raises KeyError if there is none.
+        """
+        return self._build_assignment(self._assignment_index[reference_name])
+
+    def required_assignments(self, reference_names):
+        """ Return the assignments of reference_names along with all
+        assignments in this module they depend on, directly or indirectly,
+        in module order. Only these assignments are built.
+        """
+        required = set()
+        pending = list(reference_names)
+        while pending:
+            i = self._assignment_index[pending.pop()]
+            if i in required:
+                continue
+            required.add(i)
+            pending.extend(r for r in self._build_assignment(i).references()
+                           if r in self._assignment_index)
+
+        return [self._assignments[i] for i in sorted(required)]
+
+    def children(self):
+        children = [n for n in (self.exports, self.imports) if isinstance(n, SemaNode)]
+        return children + self.assignments
+
+    def _build_assignment(self, i):
+        assignment = self._assignments[i]
+        if assignment is None:
+            token = self._assignment_tokens[i]
+            if isinstance(token, SemaNode):
+                # Built during the parse, see parse_semantic_model.
+                assignment = token
+            else:
+                # Constructed types tag themselves if automatic tagging is on.
+                outer_tag_default = getattr(_construction_state, 'tag_default', None)
+                _construction_state.tag_default = self.tag_default
+                try:
+                    assignment = _create_sema_node(token)
+                finally:
+                    _construction_state.tag_default = outer_tag_default
+            self._assignments[i] = assignment
+
+        return assignment
+
+    def dependency_graph(self):
+        """ Return the DependencyGraph of this module's assignments. It is
+        built on first call, which builds all assignments.
+        """
+        if self._dependency_graph is None:
+            self._dependency_graph = DependencyGraph(self)
+
+        return self._dependency_graph
 
     def user_types(self):
-        if not self._user_types:
+        if self._user_types is None:
             # Index all type assignments by name
-            type_assignments = [a for a in self.assignments if isinstance(a, TypeAssignment)]
-            for user_defined in type_assignments:
-                self._user_types[user_defined.type_name] = user_defined.type_decl
+            self._user_types = dict((a.type_name, a.type_decl) for a in self.assignments
+                                    if isinstance(a, TypeAssignment))
 
         return self._user_types
 
+    def lookup(self, reference_name, referenced_modules=()):
+        """ Return the assignment of a type or value reference visible in
+        this module, and the module it is defined in. Imported symbols are
+        looked up in their module among referenced_modules.
+
+        Raises KeyError if reference_name is neither defined nor imported
+        here.
+        """
+        module_name, i = self._symbols[reference_name]
+        if i is not None:
+            return self._build_assignment(i), self
+
+        module = self._find_module(module_name, referenced_modules)
+        return module.get_assignment(reference_name), module
+
     def resolve_type_decl(self, type_decl, referenced_modules):
         """ Recursively resolve user-defined types to their built-in
         declaration.
+
+        Pass a ModuleSet as referenced_modules to look modules up by name
+        and reuse resolved references across calls. A list of modules is
+        wrapped in a new one on every call.
         """
-        if isinstance(type_decl, ReferencedType):
-            module = None
-            if not type_decl.module_ref or type_decl.module_ref.name == self.name:
-                module = self
-            else:
-                # Find the referenced module
-                for ref_mod in referenced_modules:
-                    if ref_mod.name == type_decl.module_ref.name:
-                        module = ref_mod
-                        break
-            if not module:
-                raise Exception('Unrecognized referenced module %s in %s.' % (type_decl.module_ref.name,
-                                                                              [module.name for module in
-                                                                               referenced_modules]))
-            return module.resolve_type_decl(module.user_types()[type_decl.type_name], referenced_modules)
-        else:
-            return type_decl
+        return _as_module_set(referenced_modules).resolve_type_decl(self, type_decl)
 
-    def get_type_decl(self, type_name):
-        user_types = self.user_types()
-        return user_types[type_name]
+    def get_type_decl(self, type_name, referenced_modules=()):
+        """ Return the declaration of a type defined in or imported into
+        this module. Raises KeyError if there is no such type.
+        """
+        return self._lookup_type(type_name, referenced_modules)[0]
 
-    def resolve_selection_type(self, selection_type_decl):
+    def resolve_selection_type(self, selection_type_decl, referenced_modules=()):
         if not isinstance(selection_type_decl, SelectionType):
             raise Exception("Expected SelectionType, was %s" % selection_type_decl.__class__.__name__)
 
-        choice_type = self.get_type_decl(selection_type_decl.type_decl.type_name)
+        choice_type = self.resolve_type_decl(selection_type_decl.type_decl, referenced_modules)
         for named_type in choice_type.components:
             if named_type.identifier == selection_type_decl.identifier:
                 return named_type.type_decl
 
         return None
 
+    def _lookup_type(self, type_name, referenced_modules):
+        assignment, module = self.lookup(type_name, referenced_modules)
+        if not isinstance(assignment, TypeAssignment):
+            raise KeyError(type_name)
+        return assignment.type_decl, module
+
+    def _find_module(self, module_name, referenced_modules):
+        if module_name == self.name:
+            return self
+
+        return _as_module_set(referenced_modules).find(module_name)
+
     def resolve_tag_implicitness(self, tag_implicitness, tagged_type_decl):
         """ The implicitness for a tag depends on three things:
         * Any written implicitness on the tag decl itself (``tag_implicitness``)
@@ -367,6 +788,8 @@ class Module(SemaNode):
 
 
 class Exports(SemaNode):
+    __slots__ = ('symbols',)
+
     def __init__(self, elements):
         self.symbols = [s for s in elements]
 
@@ -377,6 +800,8 @@ class Exports(SemaNode):
 
 
 class Imports(SemaNode):
+    __slots__ = ('imports',)
+
     def __init__(self, elements):
         self.imports = {}
         for symbols, module_reference in elements:
@@ -395,6 +820,9 @@ class Imports(SemaNode):
 class ModuleReference(SemaNode):
     """ We need this in the sema tree to make an inventory of all external
     module references for cross-module imports. """
+
+    __slots__ = ('name',)
+
     def __init__(self, elements):
         self.name = elements[0]
 
@@ -405,11 +833,18 @@ class ModuleReference(SemaNode):
 
 
 class GlobalModuleReference(SemaNode):
+    __slots__ = ('module_ref', 'oid')
+    _child_fields = ('module_ref', 'oid')
+
     def __init__(self, elements):
         module_ref, oid = elements
         self.module_ref = _create_sema_node(module_ref)
         self.oid = _maybe_create_sema_node(oid)
 
+    @property
+    def name(self):
+        return self.module_ref.name
+
     def __str__(self):
         module_name = self.module_ref.name
         if self.oid:
@@ -420,6 +855,8 @@ class GlobalModuleReference(SemaNode):
 
 
 class Assignment(SemaNode):
+    __slots__ = ()
+
     def references(self):
         """ Return a set of all reference names (both values and types) that
         this assignment depends on.
@@ -427,11 +864,14 @@ class Assignment(SemaNode):
         This happens to coincide with all contained SemaNodes as exposed by
         ``descendants`` with a ``reference_name`` method.
         """
-        return set(d.reference_name() for d in self.descendants()
+        return set(d.reference_name() for d in self.iter_descendants()
                    if hasattr(d, 'reference_name'))
 
 
 class TypeAssignment(Assignment):
+    __slots__ = ('type_name', 'type_decl')
+    _child_fields = ('type_decl',)
+
     def __init__(self, elements):
         if len(elements) != 3:
             raise Exception('Malformed type assignment')
@@ -449,6 +889,9 @@ class TypeAssignment(Assignment):
 
 
 class ValueAssignment(Assignment):
+    __slots__ = ('value_name', 'type_decl', 'value')
+    _child_fields = ('type_decl', 'value')
+
     def __init__(self, elements):
         value_name, type_name, _, value = elements
         self.value_name = value_name
@@ -467,21 +910,24 @@ class ValueAssignment(Assignment):
 class ConstructedType(SemaNode):
     """ Base type for SEQUENCE, SET and CHOICE. """
 
+    __slots__ = ('type_name', 'components')
+    _child_fields = ('components',)
+
     def __init__(self, elements):
         type_name, component_tokens = elements
         self.type_name = type_name
         self.components = [_create_sema_node(token)
                            for token in component_tokens]
+        if getattr(_construction_state, 'tag_default', None) == TagImplicitness.AUTOMATIC:
+            self.auto_tag()
 
     def auto_tag(self):
         # Constructed types can have ExtensionMarkers as components, ignore them
-        component_types = [c.type_decl for c in self.components
-                           if hasattr(c, 'type_decl')]
-        already_tagged = any(isinstance(c, TaggedType) for c in component_types)
+        components = [c for c in self.components if hasattr(c, 'type_decl')]
+        already_tagged = any(isinstance(c.type_decl, TaggedType) for c in components)
         if not already_tagged:
             # Wrap components in TaggedTypes
-            for tag_number, child in enumerate([c for c in self.children()
-                                                if hasattr(c, 'type_decl')]):
+            for tag_number, child in enumerate(components):
                 element = child.type_decl
                 tagged_type = TaggedType((None, str(tag_number), None, element))
                 child.type_decl = tagged_type
@@ -494,16 +940,22 @@ class ConstructedType(SemaNode):
 
 
 class ChoiceType(ConstructedType):
+    __slots__ = ()
+
     def __init__(self, elements):
         super(ChoiceType, self).__init__(elements)
 
 
 class SequenceType(ConstructedType):
+    __slots__ = ()
+
     def __init__(self, elements):
         super(SequenceType, self).__init__(elements)
 
 
 class SetType(ConstructedType):
+    __slots__ = ()
+
     def __init__(self, elements):
         super(SetType, self).__init__(elements)
 
@@ -511,6 +963,9 @@ class SetType(ConstructedType):
 class CollectionType(SemaNode):
     """ Base type for SET OF and SEQUENCE OF. """
 
+    __slots__ = ('kind', 'type_name', 'size_constraint', 'type_decl')
+    _child_fields = ('size_constraint', 'type_decl')
+
     def __init__(self, kind, elements):
         self.kind = kind
         self.type_name = self.kind + ' OF'
@@ -527,16 +982,23 @@ class CollectionType(SemaNode):
 
 
 class SequenceOfType(CollectionType):
+    __slots__ = ()
+
     def __init__(self, elements):
         super(SequenceOfType, self).__init__('SEQUENCE', elements)
 
 
 class SetOfType(CollectionType):
+    __slots__ = ()
+
     def __init__(self, elements):
         super(SetOfType, self).__init__('SET', elements)
 
 
 class TaggedType(SemaNode):
+    __slots__ = ('class_name', 'class_number', 'type_decl', 'implicitness')
+    _child_fields = ('type_decl',)
+
     def __init__(self, elements):
         self.class_name = None
         self.class_number = None
@@ -588,11 +1050,13 @@ class TaggedType(SemaNode):
 
 
 class SimpleType(SemaNode):
+    __slots__ = ('constraint', 'type_name')
+    _child_fields = ('constraint',)
+
     def __init__(self, elements):
         self.constraint = None
         self.type_name = elements[0]
         if len(elements) > 1:
-            _assert_annotated_token(elements[1])
             self.constraint = _create_sema_node(elements[1])
 
     def __str__(self):
@@ -605,10 +1069,13 @@ class SimpleType(SemaNode):
 
 
 class ReferencedType(SemaNode):
-    pass
+    __slots__ = ()
 
 
 class DefinedType(ReferencedType):
+    __slots__ = ('module_ref', 'type_name', 'constraint')
+    _child_fields = ('module_ref', 'constraint')
+
     def __init__(self, elements):
         module_ref, type_ref, size_constraint = elements
         self.module_ref = _maybe_create_sema_node(module_ref)
@@ -633,6 +1100,9 @@ class DefinedType(ReferencedType):
 
 
 class SelectionType(ReferencedType):
+    __slots__ = ('identifier', 'type_decl')
+    _child_fields = ('type_decl',)
+
     def __init__(self, elements):
         self.identifier = elements[0].elements[0]
         self.type_decl = _create_sema_node(elements[1])
@@ -651,8 +1121,11 @@ class SelectionType(ReferencedType):
 
 
 class ReferencedValue(SemaNode):
+    __slots__ = ('module_ref', 'name')
+    _child_fields = ('module_ref',)
+
     def __init__(self, elements):
-        if len(elements) > 1 and elements[0].ty == 'ModuleReference':
+        if len(elements) > 1 and isinstance(_maybe_create_sema_node(elements[0]), ModuleReference):
             self.module_ref = _create_sema_node(elements[0])
             self.name = elements[1]
         else:
@@ -671,6 +1144,9 @@ class ReferencedValue(SemaNode):
 
 
 class SingleValueConstraint(SemaNode):
+    __slots__ = ('values',)
+    _child_fields = ('values',)
+
     def __init__(self, elements):
         self.values = [_maybe_create_sema_node(e) for e in elements[0]]
 
@@ -681,6 +1157,9 @@ class SingleValueConstraint(SemaNode):
 
 
 class ValueRangeConstraint(SemaNode):
+    __slots__ = ('min_value', 'max_value')
+    _child_fields = ('min_value', 'max_value')
+
     def __init__(self, elements):
         self.min_value = _maybe_create_sema_node(elements[0])
         self.max_value = _maybe_create_sema_node(elements[1])
@@ -694,6 +1173,9 @@ class ValueRangeConstraint(SemaNode):
 class SizeConstraint(SemaNode):
     """ Size constraints nest single-value or range constraints to denote valid sizes. """
 
+    __slots__ = ('nested',)
+    _child_fields = ('nested',)
+
     def __init__(self, elements):
         self.nested = _create_sema_node(elements[0])
         if not isinstance(self.nested, (ValueRangeConstraint, SingleValueConstraint)):
@@ -706,6 +1188,9 @@ class SizeConstraint(SemaNode):
 
 
 class ComponentType(SemaNode):
+    __slots__ = ('identifier', 'type_decl', 'default_value', 'optional', 'components_of_type')
+    _child_fields = ('type_decl', 'default_value', 'components_of_type')
+
     def __init__(self, elements):
         self.identifier = None
         self.type_decl = None
@@ -714,18 +1199,18 @@ class ComponentType(SemaNode):
         self.components_of_type = None
 
         def crack_named_type(token):
-            named_type = NamedType(token)
+            named_type = _create_sema_node(token)
             self.identifier = named_type.identifier
             self.type_decl = named_type.type_decl
 
         first_token = elements[0]
-        if first_token.ty == 'NamedType':
-            crack_named_type(first_token.elements)
+        if isinstance(first_token, NamedType) or first_token.ty == 'NamedType':
+            crack_named_type(first_token)
         elif first_token.ty == 'ComponentTypeOptional':
-            crack_named_type(first_token.elements[0].elements)
+            crack_named_type(first_token.elements[0])
             self.optional = True
         elif first_token.ty == 'ComponentTypeDefault':
-            crack_named_type(first_token.elements[0].elements)
+            crack_named_type(first_token.elements[0])
             self.default_value = _maybe_create_sema_node(first_token.elements[1])
         elif first_token.ty == 'ComponentTypeComponentsOf':
             self.components_of_type = _create_sema_node(first_token.elements[0])
@@ -748,6 +1233,9 @@ class ComponentType(SemaNode):
 
 
 class NamedType(SemaNode):
+    __slots__ = ('identifier', 'type_decl')
+    _child_fields = ('type_decl',)
+
     def __init__(self, elements):
         self.identifier = elements[0].elements[0]
         self.type_decl = _create_sema_node(elements[1])
@@ -759,6 +1247,9 @@ class NamedType(SemaNode):
 
 
 class ValueListType(SemaNode):
+    __slots__ = ('constraint', 'type_name', 'named_values')
+    _child_fields = ('constraint', 'named_values')
+
     def __init__(self, elements):
         self.constraint = None
         self.type_name = elements[0]
@@ -790,6 +1281,9 @@ class ValueListType(SemaNode):
 
 
 class BitStringType(SemaNode):
+    __slots__ = ('type_name', 'named_bits', 'constraint')
+    _child_fields = ('constraint', 'named_bits')
+
     def __init__(self, elements):
         self.type_name = elements[0]
         self.named_bits = [_create_sema_node(token) for token in elements[1]]
@@ -811,6 +1305,8 @@ class BitStringType(SemaNode):
 
 
 class NamedValue(SemaNode):
+    __slots__ = ('identifier', 'value')
+
     def __init__(self, elements):
         if len(elements) == 1:
             identifier_token = elements[0]
@@ -828,6 +1324,8 @@ class NamedValue(SemaNode):
 
 
 class ExtensionMarker(SemaNode):
+    __slots__ = ()
+
     def __init__(self, elements):
         pass
 
@@ -838,6 +1336,8 @@ class ExtensionMarker(SemaNode):
 
 
 class NameForm(SemaNode):
+    __slots__ = ('name',)
+
     def __init__(self, elements):
         self.name = elements[0]
 
@@ -851,6 +1351,8 @@ class NameForm(SemaNode):
 
 
 class NumberForm(SemaNode):
+    __slots__ = ('value',)
+
     def __init__(self, elements):
         self.value = elements[0]
 
@@ -861,6 +1363,9 @@ class NumberForm(SemaNode):
 
 
 class NameAndNumberForm(SemaNode):
+    __slots__ = ('name', 'number')
+    _child_fields = ('name', 'number')
+
     def __init__(self, elements):
         self.name = _create_sema_node(elements[0])
         self.number = _create_sema_node(elements[1])
@@ -872,6 +1377,9 @@ class NameAndNumberForm(SemaNode):
 
 
 class ObjectIdentifierValue(SemaNode):
+    __slots__ = ('components',)
+    _child_fields = ('components',)
+
     def __init__(self, elements):
         self.components = [_create_sema_node(c) for c in elements]
 
@@ -882,6 +1390,8 @@ class ObjectIdentifierValue(SemaNode):
 
 
 class BinaryStringValue(SemaNode):
+    __slots__ = ('value',)
+
     def __init__(self, elements):
         self.value = elements[0]
 
@@ -892,6 +1402,8 @@ class BinaryStringValue(SemaNode):
 
 
 class HexStringValue(SemaNode):
+    __slots__ = ('value',)
+
     def __init__(self, elements):
         self.value = elements[0]
 
@@ -909,90 +1421,124 @@ def _maybe_create_sema_node(token):
 
 
 def _create_sema_node(token):
+    if isinstance(token, SemaNode):
+        # Already built by the parser, see parse_semantic_model.
+        return token
+
     _assert_annotated_token(token)
 
-    if token.ty == 'ModuleDefinition':
-        return Module(token.elements)
-    elif token.ty == 'Exports':
-        return Exports(token.elements)
-    elif token.ty == 'Imports':
-        return Imports(token.elements)
-    elif token.ty == 'TypeAssignment':
-        return TypeAssignment(token.elements)
-    elif token.ty == 'ValueAssignment':
-        return ValueAssignment(token.elements)
-    elif token.ty == 'ComponentType':
-        return ComponentType(token.elements)
-    elif token.ty == 'NamedType':
-        return NamedType(token.elements)
-    elif token.ty == 'ValueListType':
-        return ValueListType(token.elements)
-    elif token.ty == 'BitStringType':
-        return BitStringType(token.elements)
-    elif token.ty == 'NamedValue':
-        return NamedValue(token.elements)
-    elif token.ty == 'Type':
-        # Type tokens have a more specific type category
-        # embedded as their first element
-        return _create_sema_node(token.elements[0])
-    elif token.ty == 'SimpleType':
-        return SimpleType(token.elements)
-    elif token.ty == 'DefinedType':
-        return DefinedType(token.elements)
-    elif token.ty == 'SelectionType':
-        return SelectionType(token.elements)
-    elif token.ty == 'ReferencedValue':
-        return ReferencedValue(token.elements)
-    elif token.ty == 'TaggedType':
-        return TaggedType(token.elements)
-    elif token.ty == 'SequenceType':
-        return SequenceType(token.elements)
-    elif token.ty == 'ChoiceType':
-        return ChoiceType(token.elements)
-    elif token.ty == 'SetType':
-        return SetType(token.elements)
-    elif token.ty == 'SequenceOfType':
-        return SequenceOfType(token.elements)
-    elif token.ty == 'SetOfType':
-        return SetOfType(token.elements)
-    elif token.ty == 'ExtensionMarker':
-        return ExtensionMarker(token.elements)
-    elif token.ty == 'SingleValueConstraint':
-        return SingleValueConstraint(token.elements)
-    elif token.ty == 'SizeConstraint':
-        return SizeConstraint(token.elements)
-    elif token.ty == 'ValueRangeConstraint':
-        return ValueRangeConstraint(token.elements)
-    elif token.ty == 'ObjectIdentifierValue':
-        return ObjectIdentifierValue(token.elements)
-    elif token.ty == 'NameForm':
-        return NameForm(token.elements)
-    elif token.ty == 'NumberForm':
-        return NumberForm(token.elements)
-    elif token.ty == 'NameAndNumberForm':
-        return NameAndNumberForm(token.elements)
-    elif token.ty == 'BinaryStringValue':
-        return BinaryStringValue(token.elements)
-    elif token.ty == 'HexStringValue':
-        return HexStringValue(token.elements)
-    elif token.ty == 'ModuleReference':
-        return ModuleReference(token.elements)
-    elif token.ty == 'GlobalModuleReference':
-        return GlobalModuleReference(token.elements)
-
-    raise Exception('Unknown token type: %s' % token.ty)
+    try:
+        factory = _SEMA_NODE_FACTORIES[token.ty]
+    except KeyError:
+        raise Exception('Unknown token type: %s' % token.ty)
+
+    return factory(token.elements)
+
+
+def _create_type(elements):
+    # Type tokens have a more specific type category
+    # embedded as their first element
+    return _create_sema_node(elements[0])
+
+
+# Token type -> callable building the sema node from the token's elements.
+_SEMA_NODE_FACTORIES = {
+    'ModuleDefinition': Module,
+    'Exports': Exports,
+    'Imports': Imports,
+    'TypeAssignment': TypeAssignment,
+    'ValueAssignment': ValueAssignment,
+    'ComponentType': ComponentType,
+    'NamedType': NamedType,
+    'ValueListType': ValueListType,
+    'BitStringType': BitStringType,
+    'NamedValue': NamedValue,
+    'Type': _create_type,
+    'SimpleType': SimpleType,
+    'DefinedType': DefinedType,
+    'SelectionType': SelectionType,
+    'ReferencedValue': ReferencedValue,
+    'TaggedType': TaggedType,
+    'SequenceType': SequenceType,
+    'ChoiceType': ChoiceType,
+    'SetType': SetType,
+    'SequenceOfType': SequenceOfType,
+    'SetOfType': SetOfType,
+    'ExtensionMarker': ExtensionMarker,
+    'SingleValueConstraint': SingleValueConstraint,
+    'SizeConstraint': SizeConstraint,
+    'ValueRangeConstraint': ValueRangeConstraint,
+    'ObjectIdentifierValue': ObjectIdentifierValue,
+    'NameForm': NameForm,
+    'NumberForm': NumberForm,
+    'NameAndNumberForm': NameAndNumberForm,
+    'BinaryStringValue': BinaryStringValue,
+    'HexStringValue': HexStringValue,
+    'ModuleReference': ModuleReference,
+    'GlobalModuleReference': GlobalModuleReference,
+}
+
+
+def register_sema_node(token_type, factory):
+    """ Make the semantic model build sema nodes for syntax tree tokens
+    of token_type by calling factory with the token's elements. factory
+    is typically a SemaNode subclass taking elements in its constructor.
+
+    This can be used to add node classes for new grammar productions,
+    or to replace the built-in class for a token type.
+    """
+    _SEMA_NODE_FACTORIES[token_type] = factory
+
+
+def _build_sema_node(token_type, elements, start, end):
+    """ Token factory for parse_semantic_model: build the sema
+    node for token types that have one, and AnnotatedTokens for
+    the parts of the syntax tree sema nodes look into.
+    """
+    token = parser.AnnotatedToken(token_type, elements, start, end)
+    if token_type not in _SEMA_NODE_FACTORIES:
+        return token
+
+    node = _create_sema_node(token)
+    constructed = _construction_state.constructed
+    if isinstance(node, ConstructedType):
+        constructed.append(node)
+    elif isinstance(node, Module):
+        # The constructed types built since the last module are this one's.
+        if node.tag_default == TagImplicitness.AUTOMATIC:
+            for constructed_type in constructed:
+                constructed_type.auto_tag()
+        del constructed[:]
+    return node
+
+
+def _tag_implicitness(tag_default):
+    if tag_default == 'IMPLICIT TAGS':
+        return TagImplicitness.IMPLICIT
+    elif tag_default == 'EXPLICIT TAGS':
+        return TagImplicitness.EXPLICIT
+    elif tag_default == 'AUTOMATIC TAGS':
+        return TagImplicitness.AUTOMATIC
+    elif tag_default is not None:
+        raise Exception('Unexpected tag default: %s' % tag_default)
+    # Tag default was not specified, default to explicit
+    return TagImplicitness.EXPLICIT
 
 
 def _assert_annotated_token(obj):
-    if type(obj) is not parser.AnnotatedToken:
+    if not isinstance(obj, parser.AnnotatedToken):
         raise Exception('Object %r is not an annotated token' % obj)
 
 
-# HACK: Generate unique names for unnamed members
-_unnamed_counter = 0
+def _assignment_name(token):
+    if isinstance(token, Assignment):
+        return token.reference_name()
+    elif isinstance(token, parser.LazyAnnotatedToken):
+        return token.name
+    return token.elements[0]
 
 
-def _get_next_unnamed():
-    global _unnamed_counter
-    _unnamed_counter += 1
-    return 'unnamed%d' % _unnamed_counter
+# Per-thread state while building sema nodes: tag_default is the tag
+# default of the module being built, constructed the ConstructedTypes
+# parse_semantic_model has built for the module being parsed.
+_construction_state = threading.local()
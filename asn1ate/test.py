@@ -40,6 +40,20 @@ def parse_args():
                     help='Write Python module files to directory instead of stdout')
     ap.add_argument('--include-asn1', action='store_true',
                     help='Pass --include-asn1 to code generator')
+    ap.add_argument('--memoize', action='store_true',
+                    help='Use packrat parsing and report cache hits and misses')
+    ap.add_argument('--cache-size', type=int, default=128,
+                    help='Packrat cache size for --memoize, 0 for unbounded (default: 128)')
+    ap.add_argument('--backend', choices=parser.BACKENDS, default='pyparsing',
+                    help='Parser backend to use (default: pyparsing)')
+    ap.add_argument('--workers', type=int, default=1,
+                    help='Parse modules in parallel in this many processes, 0 for one per CPU (default: 1)')
+    ap.add_argument('--profile', action='store_true',
+                    help='Report attempts, failures and time per grammar production')
+    ap.add_argument('--backtracks', action='store_true',
+                    help='Count grammar production attempts that failed and were backtracked')
+    ap.add_argument('--profile-sort', choices=parser.ParseProfile.SORT_KEYS, default='cumtime',
+                    help='Sort order of the --profile report (default: cumtime)')
 
     # Actions
     group = ap.add_mutually_exclusive_group(required=True)
@@ -49,6 +63,8 @@ def parse_args():
                        help='Only parse and build semantic model')
     group.add_argument('--gen', action='store_true',
                        help='Parse, build semantic model and generate pyasn1 code (default)')
+    group.add_argument('--compare-backends', action='store_true',
+                       help='Parse with all parser backends and check that the trees are identical')
 
     return ap.parse_args()
 
@@ -64,22 +80,113 @@ def generate_module_code(args):
             os.chdir(args.outdir)
 
         pyasn1gen.main(argparse.Namespace(file=infile, split=split,
-                                          include_asn1=args.include_asn1))
+                                          include_asn1=args.include_asn1,
+                                          no_cache=True))
     finally:
         os.chdir(prev_cwd)
 
 
+def diff_parse_trees(left, right, path='root'):
+    """ Return a description of the first difference between two parse
+    trees, or None if they are identical.
+    """
+    # Lazily parsed assignments are AnnotatedTokens too.
+    if isinstance(left, parser.AnnotatedToken) and isinstance(right, parser.AnnotatedToken):
+        if left.ty != right.ty:
+            return '%s: %s != %s' % (path, left.ty, right.ty)
+        if (left.start, left.end) != (right.start, right.end):
+            return '%s/%s: span %s-%s != %s-%s' % (path, left.ty, left.start, left.end,
+                                                   right.start, right.end)
+        return diff_parse_trees(left.elements, right.elements, '%s/%s' % (path, left.ty))
+    elif type(left) is not type(right):
+        return '%s: %r != %r' % (path, left, right)
+    elif type(left) is list:
+        if len(left) != len(right):
+            return '%s: %r != %r' % (path, left, right)
+        for i, (l, r) in enumerate(zip(left, right)):
+            difference = diff_parse_trees(l, r, '%s[%d]' % (path, i))
+            if difference:
+                return difference
+        return None
+    elif left != right:
+        return '%s: %r != %r' % (path, left, right)
+
+    return None
+
+
+def compare_backends(asn1def):
+    results = []
+    for backend in parser.BACKENDS:
+        try:
+            results.append((backend, parser.parse_asn1(asn1def, backend=backend)))
+        except Exception as e:
+            results.append((backend, e))
+
+    # Lazy parsing must end up with the same trees as the eager pyparsing
+    # parse once every assignment has been parsed. Parse them all here (str
+    # does), so syntax errors in them count as the lazy parse failing.
+    try:
+        lazy = parser.parse_asn1(asn1def, lazy=True)
+        str(lazy)
+        results.append(('lazy', lazy))
+    except Exception as e:
+        results.append(('lazy', e))
+
+    reference_backend, reference = results[0]
+    failed = False
+    for backend, result in results[1:]:
+        if isinstance(reference, Exception) or isinstance(result, Exception):
+            if not (isinstance(reference, Exception) and isinstance(result, Exception)):
+                print('MISMATCH: %s: %s, %s: %s' % (reference_backend, _outcome(reference),
+                                                    backend, _outcome(result)))
+                failed = True
+            continue
+
+        difference = diff_parse_trees(reference, result)
+        if difference:
+            print('MISMATCH: %s vs %s at %s' % (reference_backend, backend, difference))
+            failed = True
+
+    if failed:
+        return 1
+
+    if isinstance(reference, Exception):
+        print('OK (all backends reject input)')
+    else:
+        print('OK')
+    return 0
+
+
+def _outcome(result):
+    if isinstance(result, Exception):
+        return 'error: %s' % result
+    return 'parsed %d module(s)' % len(result)
+
+
 # Simplistic command-line driver
 def main():
     args = parse_args()
-    with open(args.file) as f:
-        asn1def = f.read()
-
     if args.outdir and not args.gen:
         print('ERROR: can only use --outdir with --gen', file=sys.stderr)
         return 1
 
-    parse_tree = parser.parse_asn1(asn1def)
+    with open(args.file, 'rb') as f:
+        if args.compare_backends:
+            return compare_backends(f.read())
+
+        parse_tree = parser.parse_asn1(f, memoize=args.memoize,
+                                       cache_size=args.cache_size or None,
+                                       backend=args.backend, workers=args.workers or None,
+                                       profile=args.profile or args.backtracks)
+    if args.memoize:
+        print('Packrat cache: %d hits, %d misses' % parser.packrat_cache_stats(),
+              file=sys.stderr)
+    if args.profile and parser.parse_profile():
+        parser.parse_profile().report(sort=args.profile_sort, out=sys.stderr)
+    if args.backtracks and parser.parse_profile():
+        print('Backtracks: %d of %d production attempts' % parser.parse_profile().totals()[::-1],
+              file=sys.stderr)
+
     if args.parse:
         parser.print_parse_tree(parse_tree)
         return 0
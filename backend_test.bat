@@ -0,0 +1,13 @@
+@ECHO OFF
+
+REM For every *.asn file, parse it with all parser backends
+REM and check that they produce identical parse trees (or
+REM that they all reject it).
+
+FOR %%t IN (testdata\*.asn testdata\public\*.asn) DO (
+  @ECHO Checking %%t
+  python asn1ate\test.py --compare-backends %%t
+  IF %ERRORLEVEL% NEQ 0 (
+     EXIT /B %ERRORLEVEL%
+  )
+)
@@ -0,0 +1,14 @@
+#!/bin/sh
+
+# For every *.asn file, parse it with all parser backends
+# and check that they produce identical parse trees (or
+# that they all reject it).
+
+set -e
+
+export PYTHONPATH=`pwd`
+for f in testdata/*.asn testdata/public/*.asn;
+do
+    echo "Checking $f";
+    python asn1ate/test.py --compare-backends $f
+done